@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Read-only access to the files in zip archives, without extracting them.
+
+The central directory of an archive is read once into a ZipIndex, which can
+then list, read and extract members as if they were files in a folder.
+Recently read members are kept decompressed in memory, up to a size limit.
+
+Mods and graphics packs may be kept as ``LNP/<folder>/<pack>.zip`` instead
+of a folder; resolve_pack maps paths inside such packs to their archive.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os, zipfile, hashlib, shutil, collections
+from threading import Lock
+
+from . import log, paths, statcache
+
+# Bytes of decompressed members kept in memory per archive
+CACHE_BYTES = 32 * 1024 * 1024
+# Content folders that may hold zipped packs
+PACK_FOLDERS = ('mods', 'graphics')
+
+_indexes = {}
+_indexes_lock = Lock()
+
+class ZipIndex(object):
+    """Index of the members of a zip archive."""
+    def __init__(self, path, cache_bytes=CACHE_BYTES):
+        """Constructor for ZipIndex.
+
+        Params:
+            path
+                the zip archive to index
+            cache_bytes
+                the maximum size of decompressed members to keep in memory
+        """
+        self.path = path
+        self.cache_bytes = cache_bytes
+        self.lock = Lock()
+        self.members = {}
+        self.children = {'': (set(), [])}
+        self._zip = zipfile.ZipFile(path)
+        self._cache = collections.OrderedDict()
+        self._cached = 0
+        for info in self._zip.infolist():
+            name = info.filename.replace('\\', '/').strip('/')
+            if not name:
+                continue
+            if '..' in name.split('/') or ':' in name.split('/')[0]:
+                log.w('Ignoring unsafe member {} in {}'.format(
+                    info.filename, path))
+                continue
+            if info.filename.endswith('/'):
+                self._add_folder(name)
+            else:
+                self.members[name] = info
+                folder, _, base = name.rpartition('/')
+                self._add_folder(folder)
+                self.children[folder][1].append(base)
+        # A single top-level folder holding everything, as in most packs
+        self.top = ''
+        dirs, files = self.children['']
+        if len(dirs) == 1 and not files:
+            self.top = list(dirs)[0]
+        log.d('Indexed {} files in {}'.format(len(self.members), path))
+
+    def _add_folder(self, folder):
+        """Adds <folder> and its parents to the folder tree."""
+        if folder in self.children:
+            return
+        parent, _, base = folder.rpartition('/')
+        self._add_folder(parent)
+        self.children[folder] = (set(), [])
+        self.children[parent][0].add(base)
+
+    def isfile(self, relpath):
+        """Returns True if <relpath> is a file in the archive."""
+        return relpath.strip('/') in self.members
+
+    def isdir(self, relpath):
+        """Returns True if <relpath> is a folder in the archive."""
+        return relpath.strip('/') in self.children
+
+    def getsize(self, relpath):
+        """Returns the uncompressed size of the file at <relpath>."""
+        return self.members[relpath.strip('/')].file_size
+
+    def walk(self, relpath=''):
+        """Walks the folder <relpath> in the archive top-down, like os.walk.
+
+        Yields:
+            tuple(folder, dirs, files), with folder relative to the archive
+            and '/'-separated
+        """
+        relpath = relpath.strip('/')
+        if relpath not in self.children:
+            return
+        dirs, files = self.children[relpath]
+        dirs = sorted(dirs)
+        yield relpath, dirs, sorted(files)
+        for d in dirs:
+            for item in self.walk(relpath + '/' + d if relpath else d):
+                yield item
+
+    def files(self, relpath=''):
+        """Returns the paths of all files in the folder <relpath>."""
+        prefix = relpath.strip('/')
+        if prefix:
+            prefix += '/'
+        return sorted(n for n in self.members if n.startswith(prefix))
+
+    def read(self, relpath):
+        """Returns the contents of the file at <relpath> as bytes.
+
+        Raises:
+            IOError if there is no such file
+        """
+        name = relpath.strip('/')
+        with self.lock:
+            if name in self._cache:
+                self._cache[name] = data = self._cache.pop(name)
+                return data
+            if name not in self.members:
+                raise IOError('No file {} in {}'.format(name, self.path))
+            data = self._zip.read(self.members[name])
+            if len(data) <= self.cache_bytes // 4:
+                self._cache[name] = data
+                self._cached += len(data)
+                while self._cached > self.cache_bytes:
+                    _, old = self._cache.popitem(last=False)
+                    self._cached -= len(old)
+        return data
+
+    def extract_tree(self, relpath, target, ignore=()):
+        """Extracts the folder <relpath> in the archive to <target>, which
+        must not exist.
+
+        Params:
+            relpath
+                the folder to extract
+            target
+                the path of the new folder
+            ignore
+                paths relative to <relpath> of files or folders to leave out
+
+        Returns:
+            The number of files extracted
+        """
+        relpath = relpath.strip('/')
+        ignore = [i.replace(os.sep, '/') for i in ignore]
+        count = 0
+        for root, dirs, files in self.walk(relpath):
+            rel = root[len(relpath):].strip('/')
+            dirs[:] = [d for d in dirs
+                       if (rel + '/' + d if rel else d) not in ignore]
+            folder = os.path.join(target, *rel.split('/')) if rel else target
+            os.makedirs(folder)
+            for k in files:
+                if (rel + '/' + k if rel else k) in ignore:
+                    continue
+                name = root + '/' + k if root else k
+                dest = os.path.join(folder, k)
+                with self.lock:
+                    with self._zip.open(self.members[name]) as src:
+                        with open(dest, 'wb') as out:
+                            shutil.copyfileobj(src, out)
+                count += 1
+        return count
+
+    def digest(self, relpath=''):
+        """Returns a hash of the names, sizes and CRCs of all files in the
+        folder <relpath>, without decompressing them."""
+        skip = len(relpath.strip('/'))
+        h = hashlib.sha1()
+        for name in self.files(relpath):
+            info = self.members[name]
+            h.update('{}:{}:{:08x}\n'.format(
+                name[skip:], info.file_size, info.CRC).encode('utf-8'))
+        return h.hexdigest()
+
+    def close(self):
+        """Closes the archive and drops cached members."""
+        with self.lock:
+            self._zip.close()
+            self._cache.clear()
+            self._cached = 0
+
+def get(path):
+    """Returns the shared ZipIndex for the archive at <path>, re-reading it
+    if the archive changed."""
+    key = os.path.abspath(path)
+    mtime = os.path.getmtime(key)
+    with _indexes_lock:
+        entry = _indexes.get(key)
+        if entry is None or entry[0] != mtime:
+            if entry is not None:
+                entry[1].close()
+            entry = _indexes[key] = (mtime, ZipIndex(key))
+        return entry[1]
+
+def forget(path):
+    """Closes the shared index for <path>, if it was opened."""
+    with _indexes_lock:
+        entry = _indexes.pop(os.path.abspath(path), None)
+    if entry is not None:
+        entry[1].close()
+
+def zipped_packs(folder):
+    """Returns the names of the packs in LNP/<folder> that are only available
+    as zip archives."""
+    base = paths.get(folder)
+    if not os.path.isdir(base):
+        return []
+    return sorted(
+        os.path.splitext(k)[0] for k in os.listdir(base)
+        if k.lower().endswith('.zip') and
+        os.path.isfile(os.path.join(base, k)) and
+        not os.path.isdir(os.path.join(base, os.path.splitext(k)[0])))
+
+def pack_archive(folder, pack):
+    """Returns the path of the archive holding LNP/<folder>/<pack>, or None
+    if the pack is a folder or does not exist."""
+    if os.path.isdir(paths.get(folder, pack)):
+        return None
+    archive = paths.get(folder, pack + '.zip')
+    if os.path.isfile(archive):
+        return archive
+    return None
+
+def resolve_pack(path):
+    """Finds the archive holding <path>, if it is in a zipped pack.
+
+    Returns:
+        tuple(ZipIndex, relpath) with a '/'-separated path in the archive,
+        or (None, None) if <path> is not in a zipped pack
+    """
+    path = os.path.abspath(path)
+    for folder in PACK_FOLDERS:
+        base = os.path.abspath(paths.get(folder))
+        if not path.startswith(base + os.sep):
+            continue
+        parts = os.path.relpath(path, base).split(os.sep)
+        archive = pack_archive(folder, parts[0])
+        if archive is None:
+            return None, None
+        index = get(archive)
+        top = [index.top] if index.top not in ('', 'raw', 'data') else []
+        return index, '/'.join(top + parts[1:])
+    return None, None
+
+def signature(path):
+    """Returns the stat signature (see statcache.signature) of the file at
+    <path>, which may be in a zipped pack, or None if there is no such
+    file."""
+    index, rel = resolve_pack(path)
+    if index is not None:
+        if not index.isfile(rel):
+            return None
+        return [os.path.getmtime(index.path), index.getsize(rel)]
+    if os.path.isdir(path):
+        return None
+    return statcache.signature(path)
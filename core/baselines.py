@@ -5,11 +5,97 @@ from __future__ import print_function, unicode_literals, absolute_import
 
 import os, glob, zipfile, tarfile, fnmatch, shutil
 # pylint:disable=redefined-builtin
-from io import open
+from io import open, StringIO
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 
-from . import paths, update, log
+from . import archives, hashindex, linkfarm, paths, update, log
 from .lnp import lnp
 
+class BaselineRegistry(object):
+    """Finds and prepares baselines, remembering the results until the
+    Baselines folder changes."""
+    def __init__(self):
+        self.lock = Lock()
+        self.stamp = None
+        self.found = {}
+
+    def _current_stamp(self):
+        """Returns the modification times of the folders holding baselines."""
+        stamp = []
+        for folder in (paths.get('baselines'), os.path.dirname(
+                _archive_path('df'))):
+            try:
+                stamp.append(os.stat(folder).st_mtime)
+            except OSError:
+                stamp.append(None)
+        return stamp
+
+    @staticmethod
+    def _contents():
+        """Returns the names of baselines and releases in the Baselines
+        folder; PyLNP's own working folders there change often."""
+        names = []
+        for folder in (paths.get('baselines'), os.path.dirname(
+                _archive_path('df'))):
+            if os.path.isdir(folder):
+                names.append(sorted(
+                    n for n in os.listdir(folder) if n.startswith('df_')))
+        return names
+
+    def invalidate(self):
+        """Forgets all results, eg. after a baseline was downloaded."""
+        with self.lock:
+            self.stamp = None
+            self.found = {}
+
+    def _refresh(self):
+        """Prepares new releases and forgets old results if baselines were
+        added or removed since the last call."""
+        stamp = self._current_stamp()
+        if self.stamp is not None and self.stamp[0] == stamp:
+            return
+        contents = self._contents()
+        if self.stamp is None or self.stamp[1] != contents:
+            prepare_baselines()
+            stamp, contents = self._current_stamp(), self._contents()
+            self.found = {}
+        self.stamp = (stamp, contents)
+
+    def find(self, version):
+        """Returns the path to the baseline for <version> (eg. 'df_40_15'), or
+        False if it is not available."""
+        with self.lock:
+            self._refresh()
+            if version not in self.found:
+                path = paths.get('baselines', version)
+                if os.path.isdir(path) or os.path.isfile(
+                        _archive_path(version)):
+                    # Archives are virtual baselines; read with the
+                    # functions below
+                    self.found[version] = path
+                else:
+                    self.found[version] = False
+            return self.found[version]
+
+    def is_ready(self, version):
+        """Returns True if the baseline for <version> was found and nothing in
+        the Baselines folder changed since. Prepares and downloads
+        nothing."""
+        with self.lock:
+            return bool(self.stamp is not None and
+                        self.stamp[0] == self._current_stamp() and
+                        self.found.get(version))
+
+registry = BaselineRegistry()
+
+def current_version():
+    """Returns the name of the baseline for the current DF version, eg.
+    ``'df_40_15'``, or None if version detection is not accurate."""
+    if lnp.df_info.source == "init detection":
+        return None
+    return 'df_' + str(lnp.df_info.version)[2:].replace('.', '_')
+
 def find_vanilla(download_missing=True):
     """Finds the vanilla baseline for the current version.
 
@@ -21,16 +107,20 @@ def find_vanilla(download_missing=True):
         ``False`` if baseline not available (and start download),
         ``None`` if version detection is not accurate
     """
-    if lnp.df_info.source == "init detection":
+    version = current_version()
+    if version is None:
         log.w('Baseline DF version from init detection; highly unreliable!')
         return None
-    prepare_baselines()
-    version = 'df_' + str(lnp.df_info.version)[2:].replace('.', '_')
-    if os.path.isdir(paths.get('baselines', version)):
-        return paths.get('baselines', version)
-    if download_missing:
+    found = registry.find(version)
+    if not found and download_missing:
         update.download_df_baseline()
-    return False
+    return found
+
+def vanilla_ready():
+    """Returns True if the baseline for the current version is known to be
+    available, without preparing or downloading anything."""
+    version = current_version()
+    return version is not None and registry.is_ready(version)
 
 def find_vanilla_raws(download_missing=True):
     """Finds vanilla raws for the current version."""
@@ -40,120 +130,255 @@ def find_vanilla_raws(download_missing=True):
     return retval
 
 def prepare_baselines():
-    """Unzip any DF releases found, and discard non-universial files."""
-    archives = glob.glob(os.path.join(paths.get('baselines'), 'df_??_?*.???'))
-    if archives:
-        log.i('Extracting archives in baselines: ' + str(archives))
-    for item in archives:
+    """Unzip any DF releases found, extracting only universal files."""
+    releases = glob.glob(os.path.join(paths.get('baselines'), 'df_??_?*.???'))
+    if releases:
+        log.i('Extracting archives in baselines: ' + str(releases))
+    for item in releases:
         version = os.path.basename(item)
         for s in ('_win32', '_osx32', '_linux32', '_legacy32',
                   '_win', '_osx', '_linux', '_legacy', '_s',
                   '.zip', '.tar.bz2'):
             version = version.replace(s, '')
         f = paths.get('baselines', version)
-        if not os.path.isdir(f):
+        if (item.endswith('.zip') and will_keep_archives() and
+                not os.path.isdir(f)):
+            if not os.path.isdir(os.path.dirname(_archive_path(version))):
+                os.makedirs(os.path.dirname(_archive_path(version)))
+            if os.path.isfile(_archive_path(version)):
+                os.remove(_archive_path(version))
+            os.rename(item, _archive_path(version))
+            archives.get(_archive_path(version))
+            continue
+        if not os.path.isdir(f) and not os.path.isfile(_archive_path(version)):
+            keep = keep_patterns('baselines')
             if item.endswith('.zip'):
-                zipfile.ZipFile(item).extractall(f)
+                _extract_zip(item, f, keep)
             elif item.endswith('.tar.bz2'):
-                tarfile.TarFile(item).extractall(f)
-                for k in glob.glob(os.path.join(f, 'df_*x', '*')):
-                    shutil.move(k, f)
-            simplify_pack(version, 'baselines')
+                _extract_tar(item, f, keep)
         os.remove(item)
 
-def set_auto_download(value):
-    """Sets the option for auto-download of baselines."""
-    lnp.userconfig['downloadBaselines'] = value
-    lnp.userconfig.save_data()
+def _is_safe_member(name):
+    """Returns True if the archive member <name> stays inside the folder it
+    is extracted to: it must be relative and must not contain '..'."""
+    parts = name.replace('\\', '/').split('/')
+    return not (name.startswith(('/', '\\')) or ':' in parts[0] or
+                '..' in parts)
 
-def simplify_pack(pack, folder):
-    """Removes unnecessary files from LNP/<folder>/<pack>.
+def _extract_zip(archive, target, keep):
+    """Extracts the members of a zip archive that match <keep> into
+    <target>, decompressing several members at once."""
+    with zipfile.ZipFile(archive) as zf:
+        members = sorted((m for m in zf.infolist() if not m.filename.endswith(
+            '/') and _is_safe_member(m.filename) and
+                          is_kept(m.filename, keep)),
+                         key=lambda m: -m.file_size)
+    if not members:
+        return
+    # Make every folder up front; makedirs in parallel workers could collide
+    for folder in set(os.path.dirname(m.filename) for m in members):
+        if folder and not os.path.isdir(os.path.join(target, folder)):
+            os.makedirs(os.path.join(target, folder))
+    workers = min(len(members), 4)
+    # Deal the largest members out first, so the workers finish together
+    chunks = [[m.filename for m in members[i::workers]]
+              for i in range(workers)]
+    def _extract(names):
+        # pylint:disable=missing-docstring
+        with zipfile.ZipFile(archive) as zf:
+            for name in names:
+                zf.extract(name, target)
+    pool = ThreadPool(workers)
+    try:
+        pool.map(_extract, chunks)
+    finally:
+        pool.close()
+        pool.join()
+    log.v('Extracted {} files from {}'.format(len(members), archive))
 
-    Args:
-        pack, folder: path segments in ``'./LNP/folder/pack/'`` as strings
+def _extract_tar(archive, target, keep):
+    """Extracts the members of a tar.bz2 archive that match <keep> into
+    <target> in a single streaming pass. Files in a top-level ``df_*x``
+    folder are extracted as if they were at the top level."""
+    count = 0
+    with tarfile.open(archive, 'r|bz2') as tf:
+        for member in tf:
+            parts = member.name.split('/')
+            if fnmatch.fnmatch(parts[0], 'df_*x'):
+                parts = parts[1:]
+            name = '/'.join(parts)
+            if not (member.isfile() and name and is_kept(name, keep)):
+                continue
+            if not _is_safe_member(member.name):
+                log.w('Skipping unsafe member {} in {}'.format(
+                    member.name, archive))
+                continue
+            dest = os.path.join(target, *parts)
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            src = tf.extractfile(member)
+            with open(dest, 'wb') as out:
+                shutil.copyfileobj(src, out)
+            os.chmod(dest, member.mode & 0o777)
+            os.utime(dest, (member.mtime, member.mtime))
+            count += 1
+    log.v('Extracted {} files from {}'.format(count, archive))
+
+def will_keep_archives():
+    """Returns whether DF releases are kept as zip archives and read
+    directly, instead of being extracted."""
+    return lnp.userconfig.get_bool('baseline_archives')
+
+def _archive_path(version):
+    """Returns the path of the kept archive for a baseline version."""
+    return paths.get('baselines', 'archives', version + '.zip')
+
+def _virtual(path):
+    """Finds the archive holding <path>, if it is in a baseline that is only
+    available as an archive, or in a zipped mod or graphics pack.
 
     Returns:
-        The number of files removed if successful,
-        ``False`` if an exception occurred,
-        ``None`` if folder is empty
+        tuple(ZipIndex, relpath) with a '/'-separated path in the archive,
+        or (None, None) if <path> is not in such a baseline or pack
     """
-    if folder not in ('graphics', 'mods', 'baselines'):
+    base = os.path.abspath(paths.get('baselines'))
+    path = os.path.abspath(path)
+    if not path.startswith(base + os.sep):
+        return archives.resolve_pack(path)
+    parts = os.path.relpath(path, base).split(os.sep)
+    if os.path.isdir(os.path.join(base, parts[0])):
+        return None, None
+    archive = _archive_path(parts[0])
+    if not os.path.isfile(archive):
+        return None, None
+    return archives.get(archive), '/'.join(parts[1:])
+
+def isfile(path):
+    """Like os.path.isfile, but also finds files in virtual baselines and
+    zipped packs."""
+    index, rel = _virtual(path)
+    if index is not None:
+        return index.isfile(rel)
+    return os.path.isfile(path)
+
+def isdir(path):
+    """Like os.path.isdir, but also finds folders in virtual baselines and
+    zipped packs."""
+    index, rel = _virtual(path)
+    if index is not None:
+        return index.isdir(rel)
+    return os.path.isdir(path)
+
+def getsize(path):
+    """Like os.path.getsize, but also finds files in virtual baselines and
+    zipped packs."""
+    index, rel = _virtual(path)
+    if index is not None:
+        return index.getsize(rel)
+    return os.path.getsize(path)
+
+def walk(path):
+    """Like os.walk, but also walks folders in virtual baselines and zipped
+    packs."""
+    index, rel = _virtual(path)
+    if index is None:
+        for item in os.walk(path):
+            yield item
+        return
+    for root, dirs, files in index.walk(rel):
+        sub = root[len(rel):].strip('/')
+        yield (os.path.join(path, *sub.split('/')) if sub else path,
+               dirs, files)
+
+def open_text(path, encoding='cp437', errors='strict'):
+    """Opens a text file for reading, including files in virtual baselines
+    and zipped packs. Line endings are translated as for files opened in text
+    mode."""
+    index, rel = _virtual(path)
+    if index is not None:
+        return StringIO(index.read(rel).decode(encoding, errors), newline=None)
+    return open(path, encoding=encoding, errors=errors)
+
+def copy_file(src, dst):
+    """Copies <src>, which may be in a virtual baseline or zipped pack, to
+    <dst>."""
+    index, rel = _virtual(src)
+    if index is None:
+        shutil.copy2(src, dst)
+        return
+    with open(dst, 'wb') as f:
+        f.write(index.read(rel))
+
+def same_contents(a, b):
+    """Like hashindex.same_contents, but <a> and <b> may also be files in
+    virtual baselines and zipped packs."""
+    (index_a, rel_a), (index_b, rel_b) = _virtual(a), _virtual(b)
+    if index_a is None and index_b is None:
+        return hashindex.same_contents(a, b)
+    if not (isfile(a) and isfile(b)) or getsize(a) != getsize(b):
         return False
-    log.i('Simplifying {}: {}'.format(folder, pack))
-    packdir = paths.get(folder, pack)
-    files_before = sum(len(f) for _, _, f in os.walk(packdir))
-    if files_before == 0:
-        return None
-    keep = [('raw',), ('data', 'speech')]
+    def _read(index, rel, path):
+        # pylint:disable=missing-docstring
+        if index is not None:
+            return index.read(rel)
+        with open(path, 'rb') as f:
+            return f.read()
+    return _read(index_a, rel_a, a) == _read(index_b, rel_b, b)
+
+def seed_tree(src, dst, ignore=()):
+    """Recreates the baseline folder <src> in <dst>, which must not exist, as
+    a link farm (see linkfarm.link_tree) or by extracting it from a virtual
+    baseline."""
+    index, rel = _virtual(src)
+    if index is not None:
+        return index.extract_tree(rel, dst, ignore)
+    return linkfarm.link_tree(src, dst, ignore)
+
+def tree_digest(path, subfolder=''):
+    """Returns a hash identifying the contents of <subfolder> in the baseline
+    or pack at <path>, as hashindex.TreeIndex.digest does for folders."""
+    index, rel = _virtual(path)
+    if index is not None:
+        return index.digest('/'.join(
+            p for p in (rel, subfolder.replace(os.sep, '/')) if p))
+    return hashindex.get(path).digest(subfolder)
+
+def set_auto_download(value):
+    """Sets the option for auto-download of baselines."""
+    lnp.userconfig['downloadBaselines'] = value
+    lnp.userconfig.save_data()
+
+def keep_patterns(folder):
+    """Returns the '/'-separated paths of the files and folders to keep in
+    a pack in LNP/<folder>."""
+    keep = ['raw', 'data/speech']
     if folder == 'graphics':
-        keep = [('raw', 'objects'), ('raw', 'graphics')]
+        keep = ['raw/objects', 'raw/graphics']
     if folder != 'mods':
-        keep += [('data', 'art')] + [
-            ('data', 'init', f + '.txt') for f in
+        keep += ['data/art'] + [
+            'data/init/' + f + '.txt' for f in
             ('colors', 'd_init', 'init', 'overrides')]
     if folder == 'baselines':
-        keep.append(('data', 'init', 'interface.txt'))
-    keep = [os.path.join(*k) for k in keep]
-    for root, _, files in os.walk(packdir):
-        for k in files:
-            if k == 'manifest.json' or 'readme' in k.lower():
-                continue
-            f = os.path.join(root, k)
-            if not any(fnmatch.fnmatch(f, os.path.join(packdir, pattern, '*'))
-                       for pattern in keep):
-                os.remove(f)
-    files_after = sum(len(f) for _, _, f in os.walk(packdir))
-    log.v('Removed {} files'.format(files_before - files_after))
-    return files_before - files_after
-
-def remove_vanilla_raws_from_pack(pack, folder):
-    """Remove files identical to vanilla raws, return files removed
+        keep.append('data/init/interface.txt')
+    return keep
 
-    Args:
-        pack, folder: path segments in ``'./LNP/folder/pack/'`` as strings
+def is_kept(relpath, keep):
+    """Returns True if the file at <relpath> (relative to the pack folder,
+    '/'-separated) is matched by the <keep> patterns."""
+    name = relpath.rsplit('/', 1)[-1]
+    if name == 'manifest.json' or 'readme' in name.lower():
+        return True
+    return any(fnmatch.fnmatch(relpath, pattern) or
+               fnmatch.fnmatch(relpath, pattern + '/*') for pattern in keep)
 
-    Returns:
-        int: the number of files removed
-    """
-    if not find_vanilla():
-        return 0
-    i = 0
-    for folder, van_folder in (
-            [paths.get(folder, pack, 'raw'), find_vanilla_raws()],
-            [paths.get(folder, pack, 'data', 'speech'),
-             os.path.join(find_vanilla(), 'data', 'speech')]):
-        for root, _, files in os.walk(folder):
-            for k in files:
-                f = os.path.join(root, k)
-                silently_kill = ('Thumbs.db', 'installed_raws.txt')
-                if any(f.endswith(x) for x in silently_kill):
-                    os.remove(f)
-                    continue
-                van_f = os.path.join(van_folder, os.path.relpath(f, folder))
-                if os.path.isfile(van_f):
-                    with open(van_f, encoding='cp437', errors='replace') as v:
-                        vtext = v.read()
-                    with open(f, encoding='cp437', errors='replace') as m:
-                        mtext = m.read()
-                    if vtext == mtext:
-                        os.remove(f)
-                        i += 1
-    return i
-
-def remove_empty_dirs(pack, folder):
-    """Removes empty subdirs in a mods or graphics pack.
-
-    Args:
-        pack, folder: path segments in ``'./LNP/folder/pack/'`` as strings
-
-    Returns:
-        int: the number of dirs removed
-    """
-    i = 0
-    for _ in range(3):
-        # only catches the lowest level each iteration
-        for root, dirs, files in os.walk(paths.get(folder, pack)):
-            if not dirs and not files:
-                os.rmdir(root)
-                i += 1
-    return i
+def matches_vanilla(van_f, f):
+    """Returns True if the file <f> has the same text as the vanilla file
+    <van_f>, ignoring line endings."""
+    if getsize(van_f) == os.path.getsize(f):
+        # Line ending differences would change the size
+        return same_contents(van_f, f)
+    # Could still differ only in line endings
+    with open_text(van_f, errors='replace') as v:
+        vtext = v.read()
+    with open(f, encoding='cp437', errors='replace') as m:
+        return vtext == m.read()
@@ -3,8 +3,9 @@
 """Color scheme management."""
 from __future__ import print_function, unicode_literals, absolute_import
 
-import os, shutil
-from . import helpers, paths, log
+import os, shutil, hashlib
+from threading import Lock
+from . import archives, baselines, helpers, paths, log
 from .lnp import lnp
 from .dfraw import DFRaw
 
@@ -22,6 +23,74 @@ def read_colors():
          helpers.get_text_files(paths.get('colors'))],
         key=helpers.key_from_underscore_prefixed_string))
 
+def fingerprint(colorlist):
+    """Returns a hash identifying the RGB tuples in <colorlist>."""
+    return hashlib.sha1(','.join(
+        str(v) for c in colorlist for v in c).encode('ascii')).hexdigest()
+
+class ColorIndex(object):
+    """Parsed colors of color scheme files.
+
+    Each file is parsed once and only read again when its stat signature
+    changes, so previews and lookups of the installed scheme cost a stat
+    call per file."""
+    def __init__(self):
+        self.lock = Lock()
+        self.files = {}
+
+    def read(self, path):
+        """Returns the RGB tuples for all 16 colors in the file at <path>.
+
+        Raises:
+            OSError if the file does not exist, or ValueError or TypeError if
+            it can't be parsed.
+        """
+        return list(self._entry(path)[1])
+
+    def _entry(self, path):
+        """Returns a tuple (signature, colors, fingerprint) for <path>,
+        parsing the file if it changed."""
+        sig = archives.signature(path)
+        if sig is None:
+            raise OSError('No such file: ' + path)
+        with self.lock:
+            entry = self.files.get(path)
+        if entry is not None and entry[0] == sig:
+            return entry
+        color_fields = [(c+'_R', c+'_G', c+'_B') for c in _df_colors]
+        result = DFRaw(path).get_values(*color_fields)
+        colorlist = tuple(tuple(int(x) for x in t) for t in result)
+        entry = (sig, colorlist, fingerprint(colorlist))
+        with self.lock:
+            self.files[path] = entry
+        return entry
+
+    def schemes(self):
+        """Brings the index up to date with LNP/Colors.
+
+        Returns:
+            dict mapping the fingerprint of each readable scheme to its
+            basename; the first scheme in list order wins for duplicates
+        """
+        folder = paths.get('colors')
+        result = {}
+        seen = set()
+        for name in read_colors():
+            path = os.path.join(folder, name + '.txt')
+            seen.add(path)
+            # pylint:disable=bare-except
+            try:
+                result.setdefault(self._entry(path)[2], name)
+            except:
+                continue
+        with self.lock:
+            for path in [p for p in self.files if p not in seen and
+                         os.path.dirname(p) == folder]:
+                del self.files[path]
+        return result
+
+color_index = ColorIndex()
+
 def get_colors(colorscheme=None):
     """
     Returns RGB tuples for all 16 colors in <colorscheme>.txt, or
@@ -40,9 +109,7 @@ def get_colors(colorscheme=None):
                 f = paths.get('init', 'init.txt')
             else:
                 f = paths.get('init', 'colors.txt')
-        color_fields = [(c+'_R', c+'_G', c+'_B') for c in _df_colors]
-        result = DFRaw(f).get_values(*color_fields)
-        return [tuple(int(x) for x in t) for t in result]
+        return color_index.read(f)
     except:
         if colorscheme:
             log.e('Unable to read colorscheme %s', colorscheme, stack=True)
@@ -69,7 +136,7 @@ def load_colors(filename):
         lnp.settings.read_file(filename, colors, False)
         lnp.settings.write_settings()
     else:
-        shutil.copyfile(filename, paths.get('init', 'colors.txt'))
+        baselines.copy_file(filename, paths.get('init', 'colors.txt'))
 
 def save_colors(filename):
     """
@@ -114,9 +181,7 @@ def delete_colors(filename):
 
 def get_installed_file():
     """Returns the name of the currently installed color scheme, or None."""
-    files = helpers.get_text_files(paths.get('colors'))
     current_scheme = get_colors()
-    for scheme in files:
-        if get_colors(scheme) == current_scheme:
-            return os.path.splitext(os.path.basename(scheme))[0]
-    return None
+    if not current_scheme:
+        return None
+    return color_index.schemes().get(fingerprint(current_scheme))
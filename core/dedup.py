@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Shared storage for identical raw files.
+
+Every savegame keeps a full copy of its raws, and most of those files are
+identical to each other and to the baselines.  Deduplicating a tree replaces
+each file with a hard link to a file in a content store
+(``LNP/Baselines/cache/store``), named by the hash of its contents, so that
+each distinct file is only stored once.  A write to a stored file would
+change every tree linked to it; DFRaw detaches files before writing to them
+(see core.linkfarm), but other programs may not, so installed raws are only
+deduplicated automatically if ``dedup_raws`` is enabled.
+
+Hashes come from the persistent index of each tree (see core.hashindex), so
+only files that changed since the last pass are read again.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os, glob
+
+from . import paths, hashindex, log
+from .lnp import lnp
+
+TEMP_SUFFIX = '.pylnp-dedup'
+
+def _store_path(digest):
+    """Returns the path of the file with hash <digest> in the store."""
+    return paths.get('baselines', 'cache', 'store', digest[:2], digest)
+
+def will_dedup_raws():
+    """Returns whether installed raws are deduplicated automatically."""
+    return lnp.userconfig.get_value('dedup_raws', False)
+
+def _add_to_store(path, digest, store_index):
+    """Returns the path of the stored file with hash <digest>, linking <path>
+    into the store if it is not there yet, or None if it can't be stored."""
+    stored = _store_path(digest)
+    if os.path.isfile(stored):
+        if store_index.file_hash(os.path.relpath(
+                stored, store_index.root)) == digest:
+            return stored
+        # Changed in place by another program; replace it
+        log.w('Replacing modified file in raw store: ' + stored)
+        os.remove(stored)
+    try:
+        if not os.path.isdir(os.path.dirname(stored)):
+            os.makedirs(os.path.dirname(stored))
+        os.link(path, stored)
+    except (OSError, AttributeError):
+        return None
+    store_index.record(os.path.relpath(stored, store_index.root), digest)
+    return stored
+
+def dedup_tree(root):
+    """Replaces the files in <root> with links to identical files in the
+    store, adding files that are not stored yet.
+
+    Returns:
+        tuple(files, size): the number of files replaced with links, and the
+        number of bytes freed by doing so
+    """
+    if not os.path.isdir(root):
+        return 0, 0
+    index = hashindex.get(root)
+    store_index = hashindex.get(paths.get('baselines', 'cache', 'store'))
+    files, size = 0, 0
+    for rel, digest in sorted(index.refresh().items()):
+        path = os.path.join(root, rel)
+        stored = _add_to_store(path, digest, store_index)
+        if stored is None:
+            continue
+        st, st_stored = os.stat(path), os.stat(stored)
+        if (st.st_ino, st.st_dev) == (st_stored.st_ino, st_stored.st_dev):
+            continue
+        temp = path + TEMP_SUFFIX
+        try:
+            if os.path.lexists(temp):
+                os.remove(temp)
+            os.link(stored, temp)
+            os.remove(path)
+            os.rename(temp, path)
+        except (OSError, AttributeError):
+            log.d('Could not link {} to raw store'.format(path))
+            continue
+        index.record(rel, digest)
+        files += 1
+        if st.st_nlink == 1:
+            size += st.st_size
+    return files, size
+
+def prune_store():
+    """Removes files from the store that are no longer linked to any tree.
+    Returns the number of files removed."""
+    store = paths.get('baselines', 'cache', 'store')
+    count = 0
+    for root, _, files in os.walk(store):
+        for k in files:
+            f = os.path.join(root, k)
+            if os.stat(f).st_nlink == 1:
+                os.remove(f)
+                count += 1
+    if count:
+        log.d('Removed {} unused files from raw store'.format(count))
+    return count
+
+def raw_trees():
+    """Returns the trees deduplicated by dedup_raws: installed raws,
+    savegame raws and baselines."""
+    trees = [paths.get('df', 'raw')]
+    trees += [os.path.join(s, 'raw') for s in glob.glob(paths.get('save', '*'))
+              if os.path.isdir(os.path.join(s, 'raw'))]
+    trees += [b for b in glob.glob(paths.get('baselines', 'df_*'))
+              if os.path.isdir(b)]
+    return trees
+
+def dedup_raws():
+    """Deduplicates all raw trees.
+
+    Returns:
+        tuple(files, size) as for dedup_tree, summed over all trees
+    """
+    files, size = 0, 0
+    for tree in raw_trees():
+        # pylint:disable=bare-except
+        try:
+            f, s = dedup_tree(tree)
+        except:
+            log.e('Could not deduplicate ' + tree, stack=True)
+            continue
+        files += f
+        size += s
+    prune_store()
+    hashindex.save_all()
+    log.i('Deduplicated {} raw files, freeing {} bytes'.format(files, size))
+    return files, size
@@ -54,6 +54,8 @@ def set_df_folder(path):
     if lnp.args.release_prep or lnp.args.raw_lint:
         perform_checks()
     install_extras()
+    from . import graphics
+    graphics.recover_install()
     load_params()
     hacks.read_hacks()
 
@@ -74,8 +76,8 @@ def perform_checks():
         if found_baseline == False: #pylint:disable=singleton-comparison
             update.download_df_baseline(True)
         baselines.prepare_baselines()
-        graphics.simplify_graphics()
-        mods.simplify_mods()
+        graphics.simplify_graphics(lnp.args.dry_run)
+        mods.simplify_mods(lnp.args.dry_run)
     sys.exit(0)
 
 def do_rawlint(path):
@@ -8,7 +8,7 @@ import sys
 import os
 from fnmatch import fnmatch
 
-from . import log
+from . import archives, linkfarm, log
 
 if sys.version_info[0] == 3:
     #pylint: disable=redefined-builtin
@@ -351,7 +351,19 @@ class DFRaw(DFRawNode):
                 Path to raw file
             mode
                 File mode (see io.open), typically 'rt' or 'wt'
+
+        Files in zipped packs (see core.archives) can be opened for reading.
+        Files opened for writing are first detached from any hard links (see
+        core.linkfarm), so that writing to installed raws can't change the
+        baseline or cached merges they are linked to.
         """
+        if 'r' in mode and '+' not in mode:
+            index, rel = archives.resolve_pack(path)
+            if index is not None:
+                return io.StringIO(index.read(rel).decode(
+                    'cp437', 'replace'), newline=None)
+        else:
+            linkfarm.detach(path, keep_contents='w' not in mode)
         return io.open(path, mode, encoding='cp437', errors='replace')
 
     @classmethod
@@ -3,7 +3,7 @@
 """Embark profile management."""
 from __future__ import print_function, unicode_literals, absolute_import
 
-import os
+import os, hashlib
 from . import helpers, paths, log
 from .dfraw import DFRaw
 
@@ -26,9 +26,62 @@ def install_embarks(files):
             embark = DFRaw.read(paths.get('embarks', f))
             out.write(embark + "\n\n")
 
+def profile_hashes(text, prefixes=False):
+    """Returns a list of hashes of the [PROFILE] blocks in <text>, which
+    ignore blank lines and surrounding whitespace.
+
+    Params:
+        text
+            the contents of a profile file
+        prefixes
+            if True, also include the hash of each leading part of a block
+            that ends at a line, so that a profile followed by other text in
+            the same block still matches
+    """
+    hashes, h = [], None
+    for line in (l.strip() for l in text.splitlines()):
+        if line.startswith('[PROFILE]'):
+            if h is not None and not prefixes:
+                hashes.append(h.hexdigest())
+            h = hashlib.sha1(line.encode('utf-8'))
+        elif line and h is not None:
+            h.update(('\n' + line).encode('utf-8'))
+        else:
+            continue
+        if prefixes:
+            hashes.append(h.hexdigest())
+    if h is not None and not prefixes:
+        hashes.append(h.hexdigest())
+    return hashes
+
 def get_installed_files():
-    """Returns the names of the currently installed embark profiles."""
+    """Returns the names of the currently installed embark profiles.
+
+    Profiles are matched by the hashes of their [PROFILE] blocks, so the
+    installed file is parsed once; files without such blocks are searched
+    for as text."""
     files = helpers.get_text_files(paths.get('embarks'))
     current = paths.get('init', 'embark_profiles.txt')
-    result = helpers.detect_installed_files(current, files)
-    return [os.path.basename(r) for r in result]
+    if not os.path.isfile(current):
+        log.d('Nothing installed in nonexistent file {}'.format(current))
+        return []
+    try:
+        installed = set(profile_hashes(DFRaw.read(current), True))
+    except IOError:
+        log.e('Cannot check installs in {}; read failed'.format(current))
+        return []
+    result, unaligned = set(), []
+    for f in files:
+        try:
+            hashes = profile_hashes(DFRaw.read(f))
+        except IOError:
+            log.e('Cannot tell if {} is installed; read failed'.format(f))
+            continue
+        if not hashes:
+            unaligned.append(f)
+        elif installed.issuperset(hashes):
+            result.add(f)
+    if unaligned:
+        result.update(helpers.detect_installed_files(
+            current, unaligned, fragments=True))
+    return [os.path.basename(f) for f in files if f in result]
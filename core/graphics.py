@@ -3,33 +3,151 @@
 """Graphics pack management."""
 from __future__ import print_function, unicode_literals, absolute_import
 
-import os, shutil, glob
+import os, shutil, glob, collections
+from threading import Lock
 from .launcher import open_file
 from .lnp import lnp
-from . import colors, df, paths, baselines, mods, log, manifest
+from . import colors, df, paths, baselines, linkfarm, mods, log, manifest
+from . import archives, hashindex, packplan, statcache, tilesets
+from . import inventory as inventory_
 from .dfraw import DFRaw
 
 def open_graphics():
     """Opens the graphics pack folder."""
     open_file(paths.get('graphics'))
 
+# Format of the saved catalog; older catalogs are rebuilt
+CATALOG_VERSION = 2
+# Paths in a pack whose stat results decide if its catalog entry is current
+_SIGNATURE_PATHS = (
+    '', 'data', 'data/init', 'data/art', 'data/init/init.txt', 'manifest.json')
+
+class GraphicsCatalog(object):
+    """Cached metadata for the graphics packs in LNP/Graphics.
+
+    The entry for each pack holds its title, folder prefix, tooltip, fonts
+    and validity.  Entries are saved in ``LNP/Graphics/.catalog.json`` and
+    only rebuilt when the pack's folders, init.txt or manifest change, or
+    when the DF version changes."""
+    def __init__(self, folder):
+        """Constructor for GraphicsCatalog.
+
+        Params:
+            folder
+                the folder holding graphics packs
+        """
+        self.folder = folder
+        self.filename = os.path.join(folder, '.catalog.json')
+        self.lock = Lock()
+        data = statcache.load(self.filename, CATALOG_VERSION) or {}
+        self.entries = data.get('packs', {})
+
+    def _signature(self, pack):
+        """Returns the stat signature of <pack>."""
+        archive = archives.pack_archive('graphics', pack)
+        if archive is not None:
+            return [statcache.signature(archive)]
+        return [statcache.signature(
+            os.path.join(self.folder, pack, *rel.split('/')))
+                for rel in _SIGNATURE_PATHS]
+
+    @staticmethod
+    def _context():
+        """Returns the parts of the DF install that validity depends on."""
+        return [str(lnp.df_info.version), 'dfhack' in lnp.df_info.variations]
+
+    @staticmethod
+    def _build(pack, sig, context):
+        """Returns a new catalog entry for <pack>."""
+        cfg = manifest.get_cfg('graphics', pack)
+        entry = {
+            'sig': sig, 'context': context,
+            'title': cfg.get_string('title') or pack,
+            'prefix': cfg.get_string('folder_prefix') or pack,
+            'tooltip': cfg.get_string('tooltip'),
+            'valid': validate_pack(pack),
+            'font': None, 'graphics_font': None}
+        if entry['valid']:
+            init_path = paths.get('graphics', pack, 'data', 'init', 'init.txt')
+            #pylint: disable=unbalanced-tuple-unpacking
+            entry['font'], entry['graphics_font'] = DFRaw(
+                init_path).get_values('FONT', 'GRAPHICS_FONT')
+        return entry
+
+    def refresh(self):
+        """Brings the catalog up to date with the graphics folder.
+
+        Returns:
+            dict mapping pack names to catalog entries
+        """
+        with self.lock:
+            packs = [os.path.basename(o) for o in
+                     glob.glob(os.path.join(self.folder, '*'))
+                     if os.path.isdir(o)] + archives.zipped_packs('graphics')
+            context = self._context()
+            sigs = dict((pack, self._signature(pack)) for pack in packs)
+            stale = [pack for pack in packs if pack not in self.entries or
+                     self.entries[pack]['sig'] != sigs[pack] or
+                     self.entries[pack]['context'] != context]
+            manifest.preload('graphics', stale)
+            changed = bool(stale)
+            for pack in stale:
+                log.d('Updating graphics catalog entry for ' + pack)
+                self.entries[pack] = self._build(pack, sigs[pack], context)
+            for pack in set(self.entries) - set(packs):
+                del self.entries[pack]
+                changed = True
+            if changed:
+                self.save()
+            return dict(self.entries)
+
+    def save(self):
+        """Saves the catalog."""
+        statcache.save(self.filename, CATALOG_VERSION, {'packs': self.entries})
+
+    def get(self, pack):
+        """Returns the entry for <pack>, without refreshing the catalog if it
+        is already known, or None if there is no such pack."""
+        with self.lock:
+            entry = self.entries.get(pack)
+        if entry is None:
+            entry = self.refresh().get(pack)
+        return entry
+
+    def by_fonts(self):
+        """Returns a dict mapping (FONT, GRAPHICS_FONT) to valid packs."""
+        return dict(((e['font'], e['graphics_font']), p) for p, e in
+                    sorted(self.refresh().items(), reverse=True)
+                    if e['valid'])
+
+_catalog = None
+
+def catalog():
+    """Returns the catalog for the current graphics folder."""
+    global _catalog #pylint: disable=global-statement
+    if _catalog is None or _catalog.folder != paths.get('graphics'):
+        _catalog = GraphicsCatalog(paths.get('graphics'))
+    return _catalog
+
 def get_title(pack):
     """Returns the pack title; either per manifest or from dirname."""
-    title = manifest.get_cfg('graphics', pack).get_string('title')
-    if title:
-        return title
+    entry = catalog().get(pack)
+    if entry:
+        return entry['title']
     return pack
 
 def get_folder_prefix(pack):
     """Returns the pack folder_prefix; either per manifest or from dirname."""
-    folder_prefix = manifest.get_cfg('graphics', pack).get_string(
-        'folder_prefix')
-    if folder_prefix:
-        return folder_prefix
+    entry = catalog().get(pack)
+    if entry:
+        return entry['prefix']
     return pack
 
 def get_tooltip(pack):
     """Returns the tooltip for the given graphics pack."""
+    entry = catalog().get(pack)
+    if entry:
+        return entry['tooltip']
     return manifest.get_cfg('graphics', pack).get_string('tooltip')
 
 def current_pack():
@@ -42,12 +160,11 @@ def current_pack():
         if p:
             log.i('Read installed graphics ({}) from log'.format(p))
             return p
-    packs = read_graphics()
-    for p in packs:
-        if (lnp.settings.FONT == p[1] and
-                lnp.settings.GRAPHICS_FONT == p[2]):
-            log.i('Installed graphics is {} by checking tilesets'.format(p[0]))
-            return p[0]
+    p = catalog().by_fonts().get(
+        (lnp.settings.FONT, lnp.settings.GRAPHICS_FONT))
+    if p:
+        log.i('Installed graphics is {} by checking tilesets'.format(p))
+        return p
     result = str(lnp.settings.FONT)
     if lnp.settings.version_has_option('GRAPHICS_FONT'):
         result += '/'+str(lnp.settings.GRAPHICS_FONT)
@@ -65,27 +182,67 @@ def logged_graphics(logfile, start='graphics/'):
 
 def read_graphics():
     """Returns a list of tuples of (graphics dir, FONT, GRAPHICS_FONT)."""
-    packs = [os.path.basename(o) for o in
-             glob.glob(paths.get('graphics', '*')) if os.path.isdir(o)
-             and manifest.is_compatible('graphics', os.path.basename(o))]
-    result = []
-    for p in packs:
-        if not validate_pack(p):
-            continue
-        init_path = paths.get('graphics', p, 'data', 'init', 'init.txt')
-        #pylint: disable=unbalanced-tuple-unpacking
-        font, graphics = DFRaw(init_path).get_values('FONT', 'GRAPHICS_FONT')
-        result.append((p, font, graphics))
-    return tuple(sorted(result))
+    return tuple(sorted((p, e['font'], e['graphics_font'])
+                        for p, e in catalog().refresh().items() if e['valid']))
 
 def add_tilesets():
-    """Copies missing tilesets from LNP/Tilesets to the data/art folder."""
+    """Copies new or changed tilesets from LNP/Tilesets to the data/art
+    folder."""
+    tilesets.library().sync()
+
+def _list_files(folder, prefix=''):
+    """Returns a dict mapping '/'-separated paths (after <prefix>) of the
+    files in <folder>, which may be in a zipped pack, to their full paths."""
+    result = {}
+    for root, _, files in baselines.walk(folder):
+        rel = os.path.relpath(root, folder).replace(os.sep, '/')
+        for k in files:
+            result[prefix + (k if rel == '.' else rel + '/' + k)] = \
+                os.path.join(root, k)
+    return result
+
+def sync_art(pack):
+    """Updates data/art to the art of <pack>, with the tilesets from
+    LNP/Tilesets and TwbT replacements if TwbT is used.  Only files that
+    differ are copied.
+
+    Returns:
+        tuple(replaced, removed) as for linkfarm.sync_tree
+    """
+    files = {}
     for item in glob.glob(paths.get('tilesets', '*')):
-        if not os.path.exists(paths.get('data', 'art', os.path.basename(item))):
-            if os.path.isfile(item):
-                shutil.copy2(item, paths.get('data', 'art'))
-            else:
-                shutil.copytree(item, paths.get('data', 'art'))
+        name = os.path.basename(item)
+        if os.path.isfile(item):
+            files[name] = item
+        else:
+            files.update(_list_files(item, name + '/'))
+    files.update(_list_files(paths.get('graphics', pack, 'data', 'art')))
+    if ('twbt' in lnp.df_info.variations and
+            lnp.userconfig.get_value('insttwbt', True)):
+        files.update(_list_files(
+            paths.get('graphics', pack, 'data', 'twbt_art')))
+    hashindex.get(paths.get('graphics', pack))
+    # Files in zipped packs are streamed from the archive after the others
+    zipped = dict((rel, src) for rel, src in files.items()
+                  if archives.resolve_pack(src)[0] is not None)
+    # Art is never hard linked, so editing installed art can't change packs
+    replaced, removed = linkfarm.sync_tree(
+        dict((rel, src) for rel, src in files.items() if rel not in zipped),
+        paths.get('data', 'art'),
+        keep=('mouse.png', 'font.ttf') + tuple(zipped), hardlink=False)
+    for rel, src in sorted(zipped.items()):
+        dst = paths.get('data', 'art', *rel.split('/'))
+        if not baselines.same_contents(src, dst):
+            if not os.path.isdir(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            # The old file may be linked to a saved copy (see Transaction)
+            linkfarm.detach(dst, keep_contents=False)
+            baselines.copy_file(src, dst)
+            replaced += 1
+    result = replaced, removed
+    tilesets.library().invalidate()
+    log.i('Updated art: {} files copied, {} removed'.format(*result))
+    return result
 
 def install_graphics(pack):
     """Installs the graphics pack located in LNP/Graphics/<pack>.
@@ -102,29 +259,38 @@ def install_graphics(pack):
     if not baselines.find_vanilla_raws():
         log.w('Cannot install graphics when baseline raws are missing!')
         return None
+    tx = _transaction()
+    tx.begin()
     try:
         # Update raws
+        tx.save_tree(paths.get('df', 'raw'))
         if not update_graphics_raws(paths.get('df', 'raw'), pack):
+            tx.rollback()
             return 0
-        # Backup TwbT-specific art files
+        # Backup TwbT-specific art files (zipped packs are never changed)
         for item in ('white1px.png', 'transparent1px.png'):
-            if os.path.exists(paths.get('data', 'art', item)):
+            if os.path.exists(paths.get('data', 'art', item)) and \
+                    os.path.isdir(paths.get('graphics', pack)):
+                tx.save_file(paths.get('graphics', pack, 'data', 'art', item))
                 shutil.copy(paths.get('data', 'art', item),
                             paths.get('graphics', pack, 'data', 'art'))
         # Copy art
-        shutil.rmtree(paths.get('data', 'art'))
-        shutil.copytree(paths.get('graphics', pack, 'data', 'art'),
-                        paths.get('data', 'art'))
-        add_tilesets()
+        tx.save_tree(paths.get('data', 'art'))
+        sync_art(pack)
         # ensure that mouse.png and font.ttf exist (required by DF)
         base = baselines.find_vanilla()
         if base:
             for item in ('mouse.png', 'font.ttf'):
                 cur = paths.get('data', 'art', item)
                 bas = os.path.join(base, 'data', 'art', item)
-                if not os.path.isfile(cur) and os.path.isfile(bas):
-                    shutil.copy2(bas, cur)
-        # Handle init files
+                if not os.path.isfile(cur) and baselines.isfile(bas):
+                    baselines.copy_file(bas, cur)
+        # Handle init files, colors and TwbT overrides
+        for item in ('init.txt', 'd_init.txt', 'colors.txt', 'overrides.txt'):
+            tx.save_file(paths.get('init', item))
+        for item in (' Current graphics pack.txt',
+                     '_Current graphics pack.txt'):
+            tx.save_file(paths.get('colors', item))
         patch_inits(paths.get('graphics', pack))
 
         # Remove file with old space-prefixed "Current graphics pack" name
@@ -135,9 +301,9 @@ def install_graphics(pack):
         if lnp.df_info.version >= '0.31.04':
             colors.load_colors(paths.get('graphics', pack, 'data', 'init',
                                          'colors.txt'))
-            shutil.copyfile(paths.get('graphics', pack, 'data', 'init',
-                                      'colors.txt'),
-                            paths.get('colors', '_Current graphics pack.txt'))
+            baselines.copy_file(
+                paths.get('graphics', pack, 'data', 'init', 'colors.txt'),
+                paths.get('colors', '_Current graphics pack.txt'))
         else:
             colors.load_colors(paths.get('graphics', pack, 'data', 'init',
                                          'init.txt'))
@@ -152,7 +318,7 @@ def install_graphics(pack):
         except:
             pass
         try:
-            shutil.copyfile(
+            baselines.copy_file(
                 paths.get('graphics', pack, 'data', 'init', 'overrides.txt'),
                 paths.get('init', 'overrides.txt'))
         except:
@@ -162,49 +328,69 @@ def install_graphics(pack):
         if ('twbt' in lnp.df_info.variations) & lnp.userconfig.get_value('insttwbt', True):
             log.i("Need to Copy TWBT")
 
-            for folder in ['art', 'init']:
-                twbt_folder = paths.get('graphics', pack, 'data', 'twbt_' + folder)
-                target_folder = paths.get('df', 'data', folder)
-                for path, _, files in os.walk(twbt_folder):
-                    for f in files:
-                        twbt_f = os.path.join(path, f)
-                        target_f = os.path.join(target_folder, os.path.relpath(twbt_f, twbt_folder))
-                        shutil.copyfile(twbt_f, target_f)
+            # TwbT art was installed by sync_art
+            twbt_folder = paths.get('graphics', pack, 'data', 'twbt_init')
+            target_folder = paths.get('df', 'data', 'init')
+            for path, _, files in baselines.walk(twbt_folder):
+                for f in files:
+                    twbt_f = os.path.join(path, f)
+                    target_f = os.path.join(target_folder, os.path.relpath(
+                        twbt_f, twbt_folder))
+                    tx.save_file(target_f)
+                    baselines.copy_file(twbt_f, target_f)
             for folder in ['graphics', 'objects']:
                 twbt_folder = paths.get('graphics', pack, 'raw', 'twbt_'+folder)
                 target_folder = paths.get('df', 'raw', folder)
 
-                for path, _, files in os.walk(twbt_folder):
+                for path, _, files in baselines.walk(twbt_folder):
                     for f in files:
                         twbt_f = os.path.join(path, f)
                         target_f = os.path.join(target_folder, os.path.relpath(
                             twbt_f, twbt_folder))
-                        shutil.copyfile(twbt_f, target_f)
+                        linkfarm.detach(target_f, keep_contents=False)
+                        baselines.copy_file(twbt_f, target_f)
         else:
             log.i("TWBT not configured")
 
     except:
         log.e('Something went wrong while installing graphics', stack=True)
+        tx.rollback()
         df.load_params()
         return False
+    tx.commit()
     df.load_params()
     return True
 
+def _transaction():
+    """Returns the transaction used to install graphics."""
+    return linkfarm.Transaction(paths.get('baselines', 'transaction'))
+
+def recover_install():
+    """Rolls back a graphics install that was interrupted, eg. by a crash.
+    Returns True if there was one."""
+    tx = _transaction()
+    if not tx.pending():
+        return False
+    log.w('Rolling back interrupted graphics install')
+    tx.rollback()
+    return True
+
 def validate_pack(pack, df_version=None):
     """Checks for presence of all required files for a pack install."""
     if df_version is None:
         df_version = lnp.df_info.version
     result = True
     gfx_dir = paths.get('graphics', pack)
-    result &= os.path.isdir(gfx_dir)
-    result &= os.path.isdir(os.path.join(gfx_dir, 'data', 'init'))
-    result &= os.path.isdir(os.path.join(gfx_dir, 'data', 'art'))
-    result &= os.path.isfile(os.path.join(gfx_dir, 'data', 'init', 'init.txt'))
+    result &= baselines.isdir(gfx_dir)
+    result &= baselines.isdir(os.path.join(gfx_dir, 'data', 'init'))
+    result &= baselines.isdir(os.path.join(gfx_dir, 'data', 'art'))
+    result &= baselines.isfile(
+        os.path.join(gfx_dir, 'data', 'init', 'init.txt'))
     result &= manifest.is_compatible('graphics', pack, df_version)
     if df_version >= '0.31.04':
-        result &= os.path.isfile(os.path.join(
+        result &= baselines.isfile(os.path.join(
             gfx_dir, 'data', 'init', 'd_init.txt'))
-        result &= os.path.isfile(os.path.join(
+        result &= baselines.isfile(os.path.join(
             gfx_dir, 'data', 'init', 'colors.txt'))
     return result
 
@@ -285,19 +471,36 @@ def patch_inits(gfx_dir):
     lnp.settings.read_file(d_init, d_init_fields, False)
     df.save_params()
 
-def simplify_graphics():
+def simplify_graphics(dry_run=False):
     """Removes unnecessary files from all graphics packs."""
     for pack in read_graphics():
-        simplify_pack(pack[0])
-
-def simplify_pack(pack):
-    """Removes unnecessary files from one graphics pack."""
-    a = baselines.simplify_pack(pack, 'graphics')
-    b = baselines.remove_vanilla_raws_from_pack(pack, 'graphics')
-    c = baselines.remove_empty_dirs(pack, 'graphics')
-    if not all(isinstance(n, int) for n in (a, b, c)):
+        simplify_pack(pack[0], dry_run)
+
+def simplify_pack(pack, dry_run=False):
+    """Removes unnecessary files from one graphics pack.
+
+    Returns:
+        The number of files and folders removed if successful,
+        ``False`` if an exception occurred,
+        ``None`` if the pack is empty
+    """
+    log.i('Simplifying graphics: ' + pack)
+    if archives.pack_archive('graphics', pack):
+        log.i('Zipped pack {} is left unchanged'.format(pack))
+        return 0
+    # pylint:disable=bare-except
+    try:
+        plan = packplan.plan_pack(pack, 'graphics')
+        if not plan.files:
+            return None
+        if dry_run:
+            for line in plan.report():
+                log.i(line)
+            return plan.changes()
+        return plan.apply()
+    except:
+        log.e('Could not simplify graphics pack ' + pack, stack=True)
         return False
-    return a + b + c
 
 def savegames_to_update():
     """Returns a list of savegames that will be updated."""
@@ -330,26 +533,41 @@ def update_graphics_raws(raw_dir, pack):
     return False
 
 def update_savegames():
-    """Update save games with current raws."""
-    count, skipped, saves = 0, 0, savegames_to_update()
-    for save_raws in [paths.get('saves', s, 'raw') for s in saves]:
-        r = can_rebuild(os.path.join(save_raws, 'installed_raws.txt'))
-        if r and update_graphics_raws(save_raws, current_pack()):
-            count += 1
+    """Update save games with current raws.
+
+    Saves are grouped by the contents of their installed_raws.txt, so the
+    raws for each group are merged once and installed into all its saves."""
+    groups = collections.OrderedDict()
+    for save_raws in [paths.get('saves', s, 'raw') for s in
+                      savegames_to_update()]:
+        signature = mods.read_log_signature(
+            os.path.join(save_raws, 'installed_raws.txt'))
+        groups.setdefault(signature, []).append(save_raws)
+    count, skipped, pack = 0, 0, current_pack()
+    snapshot = inventory_.Inventory()
+    for group in groups.values():
+        r = can_rebuild(os.path.join(group[0], 'installed_raws.txt'),
+                        inventory=snapshot)
+        if r and update_graphics_raws(group[0], pack):
+            updated = 1 + mods.install_raw_dirs(group[1:])
+            count += updated
+            skipped += len(group) - updated
         else:
-            skipped += 1
+            skipped += len(group)
     return count, skipped
 
-def can_rebuild(log_file, strict=True):
-    """Test if user can exactly rebuild a raw folder, returning a bool."""
+def can_rebuild(log_file, strict=True, inventory=None):
+    """Test if user can exactly rebuild a raw folder, returning a bool.
+    Available content is taken from <inventory>, or a new snapshot if None."""
     if not os.path.isfile(log_file):
         log.w('Cannot change graphics without log: {}'.format(log_file))
         return not strict
+    inventory = inventory_.snapshot(inventory)
     # Graphics dirname can change as long as it begins with the folder_prefix.
-    names = [(pack, get_folder_prefix(pack))
-             for pack in [k[0] for k in read_graphics()]]
-    graphic_ok = any(logged_graphics(log_file) in n for n in names)
-    if graphic_ok and mods.can_rebuild(log_file, strict=strict):
+    logged = logged_graphics(log_file)
+    graphic_ok = any(logged in n for n in inventory.graphics_prefixes)
+    if graphic_ok and mods.can_rebuild(log_file, strict=strict,
+                                       inventory=inventory):
         return True
     log.i('Components unavailable to rebuild raws in ' +
           os.path.dirname(log_file))
@@ -360,30 +578,9 @@ def open_tilesets():
     open_file(paths.get('tilesets'))
 
 def read_tilesets():
-    """Returns a tuple of available tileset files. Also copies missing tilesets
-    from LNP/Tilesets to data/art."""
-    add_tilesets()
-    files = glob.glob(paths.get('data', 'art', '*.bmp'))
-    if 'legacy' not in lnp.df_info.variations:
-        files += glob.glob(paths.get('data', 'art', '*.png'))
-    files = sorted(
-        o for o in [os.path.basename(f) for f in files] if not any(
-            o.startswith(a) for a in [
-                'transparent1px.png', 'white1px.png', 'shadows.png', 'mouse.',
-                '_']))
-
-    i = 0
-    while i < len(files): # Manual loop to allow modification during iteration
-        filename = os.path.splitext(files[i])
-        bgname = filename[0] + '-bg.png'
-        topname = filename[0] + '-top.png'
-        if bgname in files and topname in files:
-            files.remove(bgname)
-            files.remove(topname)
-        else:
-            i = i + 1
-
-    return tuple(files)
+    """Returns a tuple of available tileset files. Also copies new or changed
+    tilesets from LNP/Tilesets to data/art."""
+    return tilesets.library().names()
 
 def current_tilesets():
     """Returns the current tilesets as a tuple (FONT, GRAPHICS_FONT)."""
@@ -395,11 +592,11 @@ def install_tilesets(font, graphicsfont):
     """Installs the provided tilesets as [FULL]FONT and GRAPHICS_[FULL]FONT.
     To skip either option, use None as the parameter.
     """
-    if font is not None and os.path.isfile(paths.get('data', 'art', font)):
+    library = tilesets.library()
+    if font is not None and library.get(font):
         df.set_option('FONT', font)
         df.set_option('FULLFONT', font)
     if (lnp.settings.version_has_option('GRAPHICS_FONT') and
-            graphicsfont is not None and os.path.isfile(
-                paths.get('data', 'art', graphicsfont))):
+            graphicsfont is not None and library.get(graphicsfont)):
         df.set_option('GRAPHICS_FONT', graphicsfont)
         df.set_option('GRAPHICS_FULLFONT', graphicsfont)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Persistent content hashes for the files in content trees.
+
+Each indexed tree (a mod, graphics pack, baseline, raw folder...) has an
+index mapping the relative path of each file to its size, modification time,
+inode and the SHA-1 hash of its contents.  A file is only read again when
+its stat signature changes, so comparing files that were seen before costs
+two ``stat`` calls.  Indexes are kept in ``LNP/Baselines/cache/hashes``,
+named by a hash of the tree's path, and saved when the program exits.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os, hashlib, atexit
+from threading import Lock
+
+from . import log, paths, statcache
+
+INDEX_VERSION = 1
+
+_indexes = {}
+_loose = {}
+_indexes_lock = Lock()
+
+def _signature(st):
+    """Returns the parts of a stat result that change with file contents.
+    This is finer than statcache.signature, since a file replaced by
+    another (eg. by a link farm) may keep its size and mtime."""
+    mtime = getattr(st, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(st.st_mtime * 1000000000)
+    return [st.st_size, mtime, st.st_ino]
+
+def hash_file(path):
+    """Returns the SHA-1 hash of the contents of <path>."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class TreeIndex(object):
+    """Content hashes of the files in a folder."""
+    def __init__(self, root, persist=True):
+        """Constructor for TreeIndex.
+
+        Params:
+            root
+                the folder to index
+            persist
+                if True, the index is loaded from and saved to disk
+        """
+        self.root = os.path.abspath(root)
+        self.files = {}
+        self.dirty = False
+        self.lock = Lock()
+        self.filename = None
+        if persist and paths.get('baselines'):
+            self.filename = paths.get(
+                'baselines', 'cache', 'hashes', hashlib.sha1(
+                    self.root.encode('utf-8')).hexdigest() + '.json')
+            self.load()
+
+    def load(self):
+        """Loads the saved index, if there is one."""
+        data = statcache.load(self.filename, INDEX_VERSION) or {}
+        self.files = {}
+        if data.get('root') == self.root:
+            self.files = data.get('files', {})
+
+    def save(self):
+        """Saves the index, if it changed and the tree still exists."""
+        if not (self.filename and self.dirty and os.path.isdir(self.root)):
+            return
+        folder = os.path.dirname(self.filename)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                log.d('Could not create ' + folder)
+                return
+        with self.lock:
+            self.dirty = not statcache.save(
+                self.filename, INDEX_VERSION,
+                {'root': self.root, 'files': self.files})
+
+    def file_hash(self, relpath, st=None):
+        """Returns the content hash of the file at <relpath> in this tree,
+        or None if it does not exist."""
+        relpath = relpath.replace(os.sep, '/')
+        path = os.path.join(self.root, relpath)
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+        sig = _signature(st)
+        entry = self.files.get(relpath)
+        if entry is not None and entry[:3] == sig:
+            return entry[3]
+        digest = hash_file(path)
+        with self.lock:
+            self.files[relpath] = sig + [digest]
+            self.dirty = True
+        return digest
+
+    def record(self, relpath, digest):
+        """Records that the file at <relpath> has the content hash <digest>,
+        eg. after replacing it with a link to a file with the same contents,
+        so that it is not read again."""
+        relpath = relpath.replace(os.sep, '/')
+        st = os.stat(os.path.join(self.root, relpath))
+        with self.lock:
+            self.files[relpath] = _signature(st) + [digest]
+            self.dirty = True
+
+    def refresh(self, subfolder=''):
+        """Brings the index up to date with the tree (or <subfolder> of it),
+        hashing new and changed files and forgetting deleted ones.
+
+        Returns:
+            dict mapping relative paths ('/'-separated) to content hashes
+        """
+        prefix = subfolder.replace(os.sep, '/').strip('/')
+        if prefix:
+            prefix += '/'
+        result = {}
+        for root, _, files in os.walk(os.path.join(self.root, prefix)):
+            for k in files:
+                f = os.path.join(root, k)
+                rel = os.path.relpath(f, self.root).replace(os.sep, '/')
+                try:
+                    result[rel] = self.file_hash(rel, os.stat(f))
+                except OSError:
+                    pass
+        with self.lock:
+            for rel in [r for r in self.files
+                        if r.startswith(prefix) and r not in result]:
+                del self.files[rel]
+                self.dirty = True
+        return result
+
+    def digest(self, subfolder=''):
+        """Returns a hash of the names and contents of all files in the tree,
+        or in <subfolder> of the tree."""
+        skip = len(subfolder.replace(os.sep, '/').strip('/'))
+        h = hashlib.sha1()
+        for rel, digest in sorted(self.refresh(subfolder).items()):
+            h.update('{}:{}\n'.format(rel[skip:], digest).encode('utf-8'))
+        return h.hexdigest()
+
+def get(root, persist=True):
+    """Returns the shared TreeIndex for the folder <root>."""
+    key = os.path.abspath(root)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = TreeIndex(key, persist)
+        return _indexes[key]
+
+def _index_for(path):
+    """Returns the loaded index containing <path> with the deepest root, or
+    an in-memory index for its folder, and the path relative to it."""
+    path = os.path.abspath(path)
+    best = None
+    for root in list(_indexes):
+        if path.startswith(root + os.sep) and (
+                best is None or len(root) > len(best)):
+            best = root
+    if best is None:
+        folder = os.path.dirname(path)
+        with _indexes_lock:
+            if folder not in _loose:
+                _loose[folder] = TreeIndex(folder, False)
+        return _loose[folder], os.path.basename(path)
+    return _indexes[best], os.path.relpath(path, best)
+
+def file_hash(path):
+    """Returns the content hash of the file at <path>, or None if it does
+    not exist. Load the index of the containing tree with get() first to use
+    and update its saved hashes."""
+    index, rel = _index_for(path)
+    return index.file_hash(rel)
+
+def same_contents(a, b):
+    """Returns True if the files <a> and <b> exist and have identical
+    contents."""
+    try:
+        sa, sb = os.stat(a), os.stat(b)
+    except OSError:
+        return False
+    if sa.st_size != sb.st_size:
+        return False
+    if (sa.st_ino, sa.st_dev) == (sb.st_ino, sb.st_dev) and sa.st_ino:
+        return True
+    return file_hash(a) == file_hash(b)
+
+def save_all():
+    """Saves all changed indexes."""
+    for index in list(_indexes.values()):
+        index.save()
+
+atexit.register(save_all)
@@ -3,11 +3,36 @@
 """Helper functions."""
 from __future__ import print_function, unicode_literals, absolute_import
 
-import sys, os, glob, platform
+import sys, os, glob, platform, collections
 
 from .dfraw import DFRaw
 from . import log
 
+try:
+    from os import scandir as _scandir
+except ImportError:
+    _scandir = None
+
+def list_dir(folder):
+    """Returns a tuple (dirs, files) of the sorted names in <folder>, using
+    a single scandir call where available. Links to folders count as
+    files."""
+    dirs, files = [], []
+    if _scandir is not None:
+        for entry in _scandir(folder):
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+    else:
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                dirs.append(name)
+            else:
+                files.append(name)
+    return sorted(dirs), sorted(files)
+
 def get_text_files(directory):
     """
     Returns a list of .txt files in <directory>.
@@ -23,42 +48,105 @@ def get_text_files(directory):
             result.append(f)
     return result
 
+# Longest pattern searched for with a MultiMatcher; its trie holds a dict
+# and a set per character, so long patterns are searched for with "in"
+MATCHER_MAX_CHARS = 1024
+
+class MultiMatcher(object):
+    """Finds which of several strings occur in a text in a single pass over
+    the text, using the Aho-Corasick algorithm."""
+    def __init__(self, patterns):
+        """Constructor for MultiMatcher.
+
+        Params:
+            patterns
+                the strings to search for
+        """
+        self.patterns = list(patterns)
+        self._goto, self._fail, self._out = [{}], [0], [set()]
+        for i, pattern in enumerate(self.patterns):
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(set())
+                    self._goto[node][ch] = nxt
+                node = nxt
+            self._out[node].add(i)
+        # Breadth-first, so that the fail links of shallower nodes are known
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = fail if fail != nxt else 0
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def search(self, text):
+        """Returns the set of indexes of the patterns that occur in <text>."""
+        found = set(self._out[0])
+        node = 0
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            if self._out[node]:
+                found |= self._out[node]
+        return found
+
+def _read_tested(f):
+    """Returns the contents of <f> to search for in an installed file."""
+    tested = DFRaw.read(f)
+    if tested.endswith('\n'):
+        tested = tested[:-1]
+    return tested
+
 def detect_installed_file(current_file, test_files):
     """Returns the file in <test_files> which is contained in
     <current_file>, or "Unknown"."""
-    try:
-        current = DFRaw.read(current_file)
-        for f in test_files:
-            tested = DFRaw.read(f)
-            if tested.endswith('\n'):
-                tested = tested[:-1]
-            if tested in current:
-                return f
-    except IOError:
-        pass
+    found = detect_installed_files(current_file, test_files)
+    if found:
+        return found[0]
     return "Unknown"
 
-def detect_installed_files(current_file, test_files):
+def detect_installed_files(current_file, test_files, fragments=False):
     """Returns a list of files in <test_files> that are contained in
-    <current_file>."""
+    <current_file>.
+
+    If <fragments> is True, the test files are expected to be short, and
+    those of up to MATCHER_MAX_CHARS characters are found with a single
+    pass of a MultiMatcher over the installed file.  Other files are
+    searched for one at a time, which is faster for whole files."""
     if not os.path.isfile(current_file):
         log.d('Nothing installed in nonexistent file {}'.format(current_file))
         return []
-    installed = []
     try:
         current = DFRaw.read(current_file)
-        for f in test_files:
-            try:
-                tested = DFRaw.read(f)
-                if tested.endswith('\n'):
-                    tested = tested[:-1]
-                if tested in current:
-                    installed.append(f)
-            except IOError:
-                log.e('Cannot tell if {} is installed; read failed'.format(f))
     except IOError:
         log.e('Cannot check installs in {}; read failed'.format(current_file))
-    return installed
+        return []
+    readable, patterns = [], []
+    for f in test_files:
+        try:
+            patterns.append(_read_tested(f))
+            readable.append(f)
+        except IOError:
+            log.e('Cannot tell if {} is installed; read failed'.format(f))
+    short = [i for i, p in enumerate(patterns)
+             if fragments and len(p) <= MATCHER_MAX_CHARS]
+    found = set(short[i] for i in MultiMatcher(
+        [patterns[i] for i in short]).search(current)) if short else set()
+    searched = set(short)
+    found.update(i for i, p in enumerate(patterns)
+                 if i not in searched and p in current)
+    return [f for i, f in enumerate(readable) if i in found]
 
 def get_resource(filename):
     """
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Snapshots of the content available to PyLNP.
+
+Listing content scans its folder and parses manifests, and a single user
+action (eg. updating all savegames) may ask the same question many times.
+An Inventory is taken once per action and passed to the functions involved;
+each kind of content is scanned the first time it is needed, and the result
+is kept for the life of the snapshot.  Take a new snapshot for each action,
+so that changes on disk are seen.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+from threading import RLock
+
+class Inventory(object):
+    """Snapshot of the available mods and graphics packs.
+
+    Each kind of content is read from disk the first time it is asked for,
+    so different kinds may be read at different times; once read, a value
+    never changes for the life of the snapshot."""
+    def __init__(self):
+        self._lock = RLock()
+        self._items = {}
+
+    def _get(self, name, read):
+        """Returns the cached result for <name>, calling <read> to compute
+        it the first time."""
+        with self._lock:
+            if name not in self._items:
+                self._items[name] = read()
+            return self._items[name]
+
+    @property
+    def mods(self):
+        """A tuple of the names of available mods."""
+        from . import mods
+        return self._get('mods', lambda: tuple(mods.read_mods()))
+
+    @property
+    def mod_set(self):
+        """A frozenset of the names of available mods."""
+        return self._get('mod_set', lambda: frozenset(self.mods))
+
+    @property
+    def graphics(self):
+        """A tuple of (graphics dir, FONT, GRAPHICS_FONT) for each available
+        graphics pack."""
+        from . import graphics
+        return self._get('graphics', lambda: tuple(graphics.read_graphics()))
+
+    @property
+    def graphics_prefixes(self):
+        """A tuple of (graphics dir, folder prefix) for each available
+        graphics pack."""
+        from . import graphics
+        return self._get('graphics_prefixes', lambda: tuple(
+            (pack, graphics.get_folder_prefix(pack))
+            for pack in [k[0] for k in self.graphics]))
+
+def snapshot(inventory=None):
+    """Returns <inventory>, or a new snapshot if it is None."""
+    if inventory is None:
+        return Inventory()
+    return inventory
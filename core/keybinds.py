@@ -4,12 +4,14 @@
 from __future__ import print_function, unicode_literals, absolute_import
 
 import collections
+import hashlib
 # pylint:disable=redefined-builtin
 from io import open
 import os
 import shutil
+from threading import Lock
 
-from . import baselines, helpers, paths, log
+from . import baselines, helpers, paths, log, statcache
 from .lnp import lnp
 
 
@@ -22,13 +24,10 @@ def _keybind_fname(filename):
 
 def read_keybinds():
     """Returns a list of keybinding files."""
-    files = []
-    for fname in helpers.get_text_files(paths.get('keybinds')):
-        with open(fname, encoding='cp437') as f:
-            if ('[DISPLAY_STRING:' in f.read()) == \
-                    ('legacy' in lnp.df_info.variations):
-                files.append(fname)
-    return tuple(sorted(os.path.basename(o) for o in files))
+    legacy = 'legacy' in lnp.df_info.variations
+    return tuple(sorted(
+        os.path.basename(f) for f, e in keybind_index.refresh().items()
+        if e[1] == legacy))
 
 def _sdl_get_binds(filename, compressed=True):
     """Return serialised keybindings for the given file.
@@ -38,7 +37,7 @@ def _sdl_get_binds(filename, compressed=True):
     bindings, improving readability and compatibility across DF versions.
     Only compatible with SDL versions however.
     """
-    with open(filename, encoding='cp437') as f:
+    with baselines.open_text(filename) as f:
         lines = f.readlines()
     od, lastkey = collections.OrderedDict(), None
     for line in (l.strip() for l in lines if l.strip()):
@@ -73,14 +72,92 @@ def _sdl_write_binds(filename, binds_od, expanded=False):
     with open(filename, 'w', encoding='cp437') as f:
         f.write(text)
 
+_vanilla_binds = {}
+
 def _get_vanilla_binds():
-    """Return the vanilla keybindings for use in compression or expansion."""
+    """Return the vanilla keybindings for use in compression or expansion.
+    Each baseline is only parsed once."""
     try:
         vanfile = os.path.join(
             baselines.find_vanilla(False), 'data', 'init', 'interface.txt')
-        return _sdl_get_binds(vanfile, compressed=False)
     except TypeError:
         log.w("Can't load or change keybinds with missing baseline!")
+        return None
+    if vanfile not in _vanilla_binds:
+        _vanilla_binds[vanfile] = _sdl_get_binds(vanfile, compressed=False)
+    return collections.OrderedDict(
+        (k, list(v)) for k, v in _vanilla_binds[vanfile].items())
+
+def canonical_hash(binds_od):
+    """Returns an order-independent hash of serialised keybindings, or None
+    if there are none."""
+    if binds_od is None:
+        return None
+    h = hashlib.sha1()
+    for k in sorted(binds_od):
+        h.update('{}\n'.format(k).encode('utf-8'))
+        for v in sorted(set(binds_od[k])):
+            h.update('  {}\n'.format(v).encode('utf-8'))
+    return h.hexdigest()
+
+class KeybindIndex(object):
+    """Index of the keybinding files in LNP/Keybinds.
+
+    Entries map each file to a tuple (signature, legacy, hash), where legacy
+    is True for files in the legacy format and hash is the canonical_hash of
+    the non-vanilla bindings in the file (None for legacy files, or without
+    a baseline).  Files are only read again when their stat signature or
+    the baseline changes."""
+    def __init__(self):
+        self.lock = Lock()
+        self.entries = {}
+        self.vanilla = None
+
+    @staticmethod
+    def _build(fname, sig):
+        """Returns a new index entry for the file <fname>."""
+        with open(fname, encoding='cp437') as f:
+            legacy = '[DISPLAY_STRING:' in f.read()
+        digest = None
+        if not legacy:
+            try:
+                digest = canonical_hash(_sdl_get_binds(fname))
+            except (IOError, OSError):
+                pass
+        return (sig, legacy, digest)
+
+    def refresh(self):
+        """Brings the index up to date with the keybindings folder.
+
+        Returns:
+            dict mapping paths of keybinding files to index entries
+        """
+        with self.lock:
+            vanilla = baselines.find_vanilla(False)
+            if vanilla != self.vanilla:
+                self.entries.clear()
+                self.vanilla = vanilla
+            files = helpers.get_text_files(paths.get('keybinds'))
+            for fname in files:
+                sig = statcache.signature(fname)
+                entry = self.entries.get(fname)
+                if entry is None or entry[0] != sig:
+                    self.entries[fname] = self._build(fname, sig)
+            for fname in set(self.entries) - set(files):
+                del self.entries[fname]
+            return dict(self.entries)
+
+    def find(self, digest):
+        """Returns the path of the first keybinding file (in sorted order)
+        with the canonical hash <digest>, or None."""
+        if digest is None:
+            return None
+        for fname, entry in sorted(self.refresh().items()):
+            if entry[2] == digest:
+                return fname
+        return None
+
+keybind_index = KeybindIndex()
 
 def load_keybinds(filename):
     """
@@ -134,19 +211,16 @@ def delete_keybinds(filename):
 
 def get_installed_file():
     """Returns the name of the currently installed keybindings."""
-    def unordered(fname):
-        """An order-independent representation of keybindings from a file."""
-        return {k: set(v) for k, v in _sdl_get_binds(fname).items()}
-
-    try:
-        installed = unordered(paths.get('df', 'data', 'init', 'interface.txt'))
-        for fname in helpers.get_text_files(paths.get('keybinds')):
-            if installed == unordered(fname):
+    if 'legacy' not in lnp.df_info.variations:
+        try:
+            fname = keybind_index.find(canonical_hash(_sdl_get_binds(
+                paths.get('df', 'data', 'init', 'interface.txt'))))
+            if fname:
                 return os.path.basename(fname)
-    except: #pylint: disable=bare-except
-        # Baseline missing, or interface.txt is missing from baseline - use
-        # plain file comparsion
-        pass
+        except: #pylint: disable=bare-except
+            # Baseline missing, or interface.txt is missing from baseline -
+            # use plain file comparsion
+            pass
 
     files = helpers.get_text_files(paths.get('keybinds'))
     current = paths.get('init', 'interface.txt')
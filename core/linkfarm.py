@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Cheap copies of file trees, using hard links or reflinks where possible.
+
+A "link farm" is a directory tree whose files share their data with another
+tree.  Creating one only creates directory entries, so it is much faster
+than copying.  Since a write to a hard linked file would also change the
+original, any code that modifies a file in a link farm must call ``detach``
+on it first to give it a private copy.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os, shutil, sys, json, errno
+from multiprocessing.pool import ThreadPool
+
+from . import hashindex, log
+
+# Linux ioctl to clone file contents (btrfs, xfs and others)
+_FICLONE = 0x40049409
+
+def _reflink(src, dst):
+    """Attempts to create <dst> as a copy-on-write clone of <src>.
+    Returns True if successful."""
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    # pylint:disable=bare-except
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+    except:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+def link_file(src, dst, hardlink=True):
+    """Creates <dst> as a hard link to <src>, falling back to a reflink and
+    then to a copy. <dst> must not exist.
+
+    Params:
+        src
+            the file to link to
+        dst
+            the path of the new file
+        hardlink
+            if False, only a reflink or a copy will be made; use this for
+            files the user is likely to edit outside PyLNP
+    """
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return
+        except (OSError, AttributeError):
+            # Cross-device, unsupported filesystem, or no os.link (Windows, Py2)
+            pass
+    if not _reflink(src, dst):
+        shutil.copy2(src, dst)
+
+def link_tree(src, dst, ignore=(), hardlink=True):
+    """Recreates the tree at <src> in <dst>, which must not exist.
+
+    Params:
+        src
+            the folder to mirror
+        dst
+            the path of the new folder
+        ignore
+            relative paths (using os.sep) of files or folders to leave out
+        hardlink
+            passed to link_file for each file
+
+    Returns:
+        The number of files linked or copied
+    """
+    count = 0
+    for root, dirs, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        dirs[:] = [d for d in dirs
+                   if os.path.normpath(os.path.join(rel, d)) not in ignore]
+        os.makedirs(os.path.normpath(os.path.join(dst, rel)))
+        for k in files:
+            if os.path.normpath(os.path.join(rel, k)) in ignore:
+                continue
+            link_file(os.path.join(root, k),
+                      os.path.normpath(os.path.join(dst, rel, k)), hardlink)
+            count += 1
+    return count
+
+def is_shared(path):
+    """Returns True if <path> is a file with more than one hard link."""
+    try:
+        return os.stat(path).st_nlink > 1
+    except OSError:
+        return False
+
+def detach(path, keep_contents=True):
+    """Ensures that writing to <path> will not affect any other file.
+
+    Params:
+        path
+            the file about to be modified
+        keep_contents
+            if False, the file is about to be replaced completely; a
+            shared file is then simply removed instead of copied
+    """
+    if not is_shared(path):
+        return
+    log.d('Detaching shared file ' + path)
+    if not keep_contents:
+        os.remove(path)
+        return
+    temp = path + '.pylnp-detach'
+    shutil.copy2(path, temp)
+    os.remove(path)
+    os.rename(temp, path)
+
+def replace_file(src, dst, hardlink=True):
+    """Replaces <dst> (which may not exist) with a link to, or copy of, <src>.
+    Other links to the old <dst> are unaffected."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    elif not os.path.isdir(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst))
+    link_file(src, dst, hardlink)
+
+def sync_tree(files, target, keep=(), hardlink=True):
+    """Makes the folder <target> contain exactly <files>, replacing only the
+    files whose contents differ and removing files that are not wanted.
+
+    Params:
+        files
+            dict mapping '/'-separated paths in <target> to source files
+        target
+            the folder to update; created if it does not exist
+        keep
+            '/'-separated paths of files in <target> to leave alone
+        hardlink
+            passed to replace_file for each replaced file
+
+    Returns:
+        tuple(replaced, removed): the numbers of files replaced or added, and
+        of files removed
+    """
+    hashindex.get(target)
+    stale = []
+    for root, _, names in os.walk(target):
+        for k in names:
+            rel = os.path.relpath(os.path.join(root, k), target).replace(
+                os.sep, '/')
+            if rel not in files and rel not in keep:
+                stale.append(rel)
+    for rel in stale:
+        os.remove(os.path.join(target, *rel.split('/')))
+    removed = set()
+    for root, dirs, names in os.walk(target, topdown=False):
+        if root != target and not names and all(
+                os.path.join(root, d) in removed for d in dirs):
+            os.rmdir(root)
+            removed.add(root)
+    # Create folders first, so the workers don't race to create them
+    for folder in set(os.path.dirname(rel) for rel in files):
+        folder = os.path.join(target, *folder.split('/'))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def _sync(item):
+        # pylint:disable=missing-docstring
+        rel, src = item
+        dst = os.path.join(target, *rel.split('/'))
+        if hashindex.same_contents(src, dst):
+            return 0
+        replace_file(src, dst, hardlink)
+        return 1
+    if not files:
+        return 0, len(stale)
+    pool = ThreadPool(min(len(files), 4))
+    try:
+        replaced = sum(pool.map(_sync, sorted(files.items())))
+    finally:
+        pool.close()
+        pool.join()
+    return replaced, len(stale)
+
+# Suffixes for the trees kept next to a target by install_tree
+STAGED_SUFFIX = '.pylnp-new'
+REPLACED_SUFFIX = '.pylnp-swap'
+BACKUP_SUFFIX = '.pylnp-old'
+# Suffix for the trees saved next to their originals by Transaction
+TRANSACTION_SUFFIX = '.pylnp-tx'
+
+def _fsync_tree(path):
+    """Flushes all files and folders in <path> to disk.
+
+    Hard linked files are synced too: a link does not mean that the data is
+    already on disk, since freshly merged files are linked into the staged
+    tree.  Syncing a file that has no unwritten data is cheap.  Files are
+    opened for writing, since Windows can't flush read-only handles; files
+    that can't be opened that way are skipped."""
+    for root, _, files in os.walk(path):
+        for k in files:
+            try:
+                fd = os.open(os.path.join(root, k), os.O_RDWR)
+            except OSError as e:
+                if e.errno in (errno.EACCES, errno.EPERM):
+                    continue
+                raise
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                if e.errno not in (errno.EBADF, errno.EINVAL):
+                    raise
+            finally:
+                os.close(fd)
+        if sys.platform != 'win32':
+            # Directories can't be opened on Windows
+            fd = os.open(root, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+def _recover(target):
+    """Puts the old tree back if an earlier swap was interrupted after
+    moving it out of the way."""
+    if not os.path.lexists(target) and os.path.lexists(
+            target + REPLACED_SUFFIX):
+        log.w('Restoring {} after interrupted install'.format(target))
+        os.rename(target + REPLACED_SUFFIX, target)
+
+def install_tree(src, target, hardlink=True):
+    """Replaces the tree at <target> with a link farm of <src>.
+
+    The new tree is staged next to <target> (so it is on the same filesystem)
+    and moved into place with renames, so an interrupted install leaves
+    either the old or the new tree (an install interrupted between the two
+    renames is completed by the next call).  The old tree is kept as
+    ``<target>.pylnp-old`` until the next successful install; see
+    rollback_tree.
+
+    Params:
+        src
+            the folder to install
+        target
+            the folder to replace
+        hardlink
+            passed to link_tree
+    """
+    staged = target + STAGED_SUFFIX
+    replaced = target + REPLACED_SUFFIX
+    _recover(target)
+    for leftover in (staged, replaced):
+        if os.path.lexists(leftover):
+            shutil.rmtree(leftover)
+    link_tree(src, staged, hardlink=hardlink)
+    _fsync_tree(staged)
+    if os.path.lexists(target):
+        os.rename(target, replaced)
+    try:
+        os.rename(staged, target)
+    except OSError:
+        if os.path.lexists(replaced):
+            os.rename(replaced, target)
+        raise
+    if os.path.lexists(target + BACKUP_SUFFIX):
+        shutil.rmtree(target + BACKUP_SUFFIX)
+    if os.path.lexists(replaced):
+        os.rename(replaced, target + BACKUP_SUFFIX)
+
+def rollback_tree(target):
+    """Restores the tree replaced by the last install_tree call on <target>.
+    Returns False if there is nothing to restore."""
+    _recover(target)
+    backup = target + BACKUP_SUFFIX
+    if not os.path.isdir(backup):
+        return False
+    replaced = target + REPLACED_SUFFIX
+    if os.path.lexists(replaced):
+        shutil.rmtree(replaced)
+    if os.path.lexists(target):
+        os.rename(target, replaced)
+    os.rename(backup, target)
+    if os.path.lexists(replaced):
+        shutil.rmtree(replaced)
+    return True
+
+class Journal(object):
+    """Records files before they are changed, so that a tree can be restored
+    to an earlier checkpoint by undoing only the changed files.
+
+    Originals are kept as hard links where possible, so recording a file is
+    about as cheap as recording its name.  Changes must replace files (as
+    detach and replace_file do) rather than write into them, or the saved
+    copy would change too."""
+    def __init__(self, folder):
+        """Constructor for Journal.
+
+        Params:
+            folder
+                where to keep the original files; removed when cleared
+        """
+        self.folder = folder
+        self.saved = {}
+
+    def record(self, path):
+        """Saves the current state of <path> (file or nothing), unless it was
+        already recorded since the last checkpoint."""
+        if path in self.saved:
+            return
+        backup = None
+        if os.path.isfile(path):
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            backup = os.path.join(self.folder, str(len(self.saved)))
+            link_file(path, backup)
+        self.saved[path] = backup
+
+    def restore(self):
+        """Undoes all changes to recorded files since the last checkpoint."""
+        for path, backup in self.saved.items():
+            if os.path.lexists(path):
+                os.remove(path)
+            if backup is not None:
+                os.rename(backup, path)
+        log.d('Restored {} files from checkpoint'.format(len(self.saved)))
+        self.checkpoint()
+
+    def checkpoint(self):
+        """Accepts all changes, making the current state the one restored."""
+        self.saved = {}
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+
+class Transaction(object):
+    """A record, kept on disk, of how to undo a sequence of changes, so that
+    a change interrupted by an error or a crash can be rolled back.
+
+    Before each step, the state it changes is saved: files are copied, since
+    they may be written in place, while folders are kept as link farms next
+    to them (so they are on the same filesystem, as for install_tree) and
+    must only be changed by replacing files (as install_tree and sync_tree
+    do).  The record is flushed to disk after every step."""
+    def __init__(self, folder):
+        """Constructor for Transaction.
+
+        Params:
+            folder
+                where to keep the record and saved state
+        """
+        self.folder = folder
+        self.filename = os.path.join(folder, 'transaction.json')
+        self.steps = []
+
+    def pending(self):
+        """Returns True if a transaction was started and not finished."""
+        return os.path.isfile(self.filename)
+
+    def begin(self):
+        """Starts a transaction, first rolling back an unfinished one."""
+        if self.pending():
+            log.w('Rolling back unfinished changes')
+            self.rollback()
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+        os.makedirs(self.folder)
+        self.steps = []
+        self._write()
+
+    def _write(self):
+        """Writes the record to disk."""
+        temp = self.filename + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(self.steps, f)
+            f.flush()
+            os.fsync(f.fileno())
+        if hasattr(os, 'replace'):
+            os.replace(temp, self.filename)
+            return
+        try:
+            # Python 2: rename replaces the old record, except on Windows
+            os.rename(temp, self.filename)
+        except OSError:
+            os.remove(self.filename)
+            os.rename(temp, self.filename)
+
+    def _save(self, kind, path, save, backup):
+        """Records a step, saving the current state of <path> with <save> to
+        <backup>.  A <backup> left by a crash before its step was recorded
+        is replaced."""
+        if not os.path.exists(path):
+            backup = None
+        elif save is not None:
+            if os.path.isdir(backup):
+                log.w('Removing unrecorded backup ' + backup)
+                shutil.rmtree(backup)
+            elif os.path.lexists(backup):
+                os.remove(backup)
+            save(path, backup)
+        self.steps.append([kind, os.path.abspath(path), backup])
+        self._write()
+
+    def save_file(self, path):
+        """Saves the file (or absence of a file) at <path>."""
+        self._save('file', path, shutil.copy2,
+                   os.path.join(self.folder, str(len(self.steps))))
+
+    def save_tree(self, path):
+        """Saves the folder (or absence of a folder) at <path>."""
+        self._save('tree', path, link_tree, '{}{}{}'.format(
+            os.path.abspath(path), TRANSACTION_SUFFIX, len(self.steps)))
+
+    def rollback(self):
+        """Undoes all saved steps, newest first, and ends the transaction."""
+        if not self.steps and self.pending():
+            try:
+                with open(self.filename) as f:
+                    self.steps = json.load(f)
+            except (IOError, OSError, ValueError):
+                log.e('Could not read unfinished changes', stack=True)
+        for kind, path, backup in reversed(self.steps):
+            if backup is not None and not os.path.lexists(backup):
+                # Restored before an interrupted rollback
+                continue
+            if kind == 'tree':
+                replaced = path + TRANSACTION_SUFFIX
+                if os.path.lexists(path):
+                    os.rename(path, replaced)
+                if backup is not None:
+                    os.rename(backup, path)
+                if os.path.lexists(replaced):
+                    shutil.rmtree(replaced)
+            elif backup is not None:
+                # Saved files may be on another filesystem, so are copied back
+                detach(path, keep_contents=False)
+                shutil.copy2(backup, path)
+                os.remove(backup)
+            elif os.path.lexists(path):
+                os.remove(path)
+        log.i('Rolled back {} steps'.format(len(self.steps)))
+        self.commit()
+
+    def commit(self):
+        """Accepts all changes, ending the transaction."""
+        for kind, _, backup in self.steps:
+            if kind == 'tree' and backup is not None and os.path.isdir(backup):
+                shutil.rmtree(backup)
+        self.steps = []
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
@@ -254,6 +254,9 @@ class PyLNP(object):
         parser.add_argument(
             '--release-prep', action='store_true',
             help=argparse.SUPPRESS)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help=argparse.SUPPRESS)
         parser.add_argument(
             '--terminal-test-parent', nargs=1,
             help=argparse.SUPPRESS)
@@ -4,13 +4,46 @@
 from __future__ import print_function, unicode_literals, absolute_import
 
 import os
+from threading import Lock
+from multiprocessing.pool import ThreadPool
 
-from . import paths, json_config
+from . import archives, paths, json_config, log
 from .lnp import lnp
 
+# Loaded manifests, keyed by (content_type, item)
+_cache = {}
+_cache_lock = Lock()
+
+def _lookup(content_type, item):
+    """Returns a tuple (signature, config) for the manifest of <item>, where
+    signature is None if the manifest does not exist. Manifests are only
+    read again when their signature changes."""
+    key = (content_type, item)
+    path = paths.get(content_type, item, 'manifest.json')
+    sig = archives.signature(path)
+    with _cache_lock:
+        entry = _cache.get(key)
+    if entry is not None and entry[:2] == (path, sig):
+        return entry[1:]
+    entry = (path, sig, _load(content_type, item))
+    with _cache_lock:
+        _cache[key] = entry
+    return entry[1:]
+
+def _stale(content_type, item):
+    """Returns True if the manifest of <item> is not cached or has changed
+    since it was read."""
+    path = paths.get(content_type, item, 'manifest.json')
+    with _cache_lock:
+        entry = _cache.get((content_type, item))
+    return entry is None or entry[:2] != (path, archives.signature(path))
+
 def get_cfg(content_type, item):
     """Returns a JSONConfiguration object for the given item.
 
+    The object is shared by all callers until the manifest changes, and must
+    not be modified.
+
     **Manifest format:**
 
     The manifest is a dictionary of values, which can be saved as manifest.json
@@ -49,6 +82,10 @@ def get_cfg(content_type, item):
     Returns:
         core.json_config.JSONConfiguration: manifest object
     """
+    return _lookup(content_type, item)[1]
+
+def _load(content_type, item):
+    """Reads the manifest for <item>; see get_cfg."""
     default_config = {
         'author': '',
         'content_version': '',
@@ -69,20 +106,29 @@ def get_cfg(content_type, item):
             'readme': '',
             })
     manifest = paths.get(content_type, item, 'manifest.json')
+    index, rel = archives.resolve_pack(manifest)
+    if index is not None and index.isfile(rel):
+        # pylint:disable=bare-except
+        try:
+            return json_config.JSONConfiguration.from_text(
+                index.read(rel).decode('utf-8'))
+        except:
+            log.e('Note: Failed to read JSON from ' + manifest +
+                  ', ignoring data - details follow', stack=True)
     return json_config.JSONConfiguration(manifest, default_config, warn=False)
 
 def exists(content_type, item):
     """Returns a bool, that the given item has a manifest.
     Used before calling get_cfg if logging a warning isn't required."""
-    return os.path.isfile(paths.get(content_type, item, 'manifest.json'))
+    return _lookup(content_type, item)[0] is not None
 
 def is_compatible(content_type, item, ver=''):
     """Boolean compatibility rating; True unless explicitly incompatible."""
-    if not exists(content_type, item):
+    sig, cfg = _lookup(content_type, item)
+    if sig is None:
         return True
     if not ver:
         ver = lnp.df_info.version
-    cfg = get_cfg(content_type, item)
     df_min_version = cfg.get_string('df_min_version')
     df_max_version = cfg.get_string('df_max_version')
     return not any([
@@ -91,3 +137,37 @@ def is_compatible(content_type, item, ver=''):
         ver in cfg.get_list('incompatible_df_versions'),
         cfg.get_bool('needs_dfhack') and 'dfhack' not in lnp.df_info.variations
         ])
+
+def preload(content_type, items=None, workers=4):
+    """Reads the manifests of <items> (default: all folders and zipped packs
+    in the content folder) into the cache, so that later lookups only check
+    signatures.  Threads are only started if some manifests must be read.
+
+    Params:
+        content_type
+            'graphics', 'mods', or 'utilities'
+        items
+            the items to read manifests for
+        workers
+            the number of threads reading manifests; more than one helps
+            when many manifests must be read from a slow disk
+    """
+    if items is None:
+        folder = paths.get(content_type)
+        items = []
+        if os.path.isdir(folder):
+            items = [k for k in sorted(os.listdir(folder))
+                     if os.path.isdir(os.path.join(folder, k))]
+        if content_type in archives.PACK_FOLDERS:
+            items += archives.zipped_packs(content_type)
+    items = [item for item in items if _stale(content_type, item)]
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            _lookup(content_type, item)
+        return
+    pool = ThreadPool(min(len(items), workers))
+    try:
+        pool.map(lambda item: _lookup(content_type, item), items)
+    finally:
+        pool.close()
+        pool.join()
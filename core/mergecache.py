@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Content-addressed cache of intermediate mod merge results.
+
+Each entry is a link farm of ``LNP/Baselines/temp`` after merging some
+prefix of a list of mods.  Entries are keyed by a hash of the baseline, the
+pre-merged graphics pack (if any) and the ordered names and contents of the
+merged mods, so that changing any input invalidates every later entry while
+earlier ones stay usable.  The least recently used entries are discarded
+once the cache grows beyond ``merge_cache_mb`` megabytes (user config).
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os, shutil, hashlib, json, time
+
+from . import paths, baselines, linkfarm, log
+from .lnp import lnp
+
+# Increase when merge results for the same inputs may change
+CACHE_VERSION = 1
+
+def _cache_path(*segments):
+    """Returns a path inside the merge cache folder."""
+    return paths.get('baselines', 'cache', 'merges', *segments)
+
+def cache_limit():
+    """Returns the maximum size of the merge cache in bytes (0: disabled)."""
+    return int(lnp.userconfig.get_value('merge_cache_mb', 256)) * 1024 * 1024
+
+def prefix_keys(list_of_mods, gfx=None):
+    """Returns the cache keys for each prefix of <list_of_mods>.
+
+    Params:
+        list_of_mods
+            a list of the names of mods to merge
+        gfx
+            the graphics pack merged before the mods, if any
+
+    Returns:
+        A list of len(list_of_mods) + 1 keys, where the key at index i
+        identifies the merge state after merging the first i mods,
+        or None if the baseline is unavailable.
+    """
+    from . import graphics, mods
+    vanilla = baselines.find_vanilla(False)
+    if not vanilla:
+        return None
+    h = hashlib.sha1('pylnp-merge:{}:{}\n'.format(
+        CACHE_VERSION, ('lines', 'objects')[mods.will_merge_objects()]
+        ).encode('utf-8'))
+    h.update('baselines/{}:{}:{}\n'.format(
+        os.path.basename(vanilla), baselines.tree_digest(vanilla, 'raw'),
+        baselines.tree_digest(vanilla, 'data/speech')).encode('utf-8'))
+    if gfx:
+        h.update('graphics/{}:{}:{}\n'.format(
+            gfx, graphics.get_folder_prefix(gfx),
+            baselines.tree_digest(paths.get('graphics', gfx), 'raw')
+            ).encode('utf-8'))
+    keys = [h.hexdigest()]
+    for mod in list_of_mods:
+        mod_path = paths.get('mods', mod)
+        h.update('mods/{}:{}:{}\n'.format(
+            mod, baselines.tree_digest(mod_path, 'raw'),
+            baselines.tree_digest(mod_path, 'data/speech')).encode('utf-8'))
+        keys.append(h.hexdigest())
+    return keys
+
+def _read_entry(key):
+    """Returns the metadata for a cache entry, or None if it is missing."""
+    try:
+        with open(_cache_path(key + '.json')) as f:
+            meta = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if not os.path.isdir(_cache_path(key)):
+        return None
+    return meta
+
+def _write_entry(key, meta):
+    """Writes the metadata for a cache entry."""
+    with open(_cache_path(key + '.json'), 'w') as f:
+        json.dump(meta, f)
+
+def restore(keys):
+    """Restores the longest cached prefix into ``LNP/Baselines/temp``.
+
+    Params:
+        keys
+            prefix keys, as returned by prefix_keys
+
+    Returns:
+        tuple(n, statuses) where n is the number of mods already merged and
+        statuses their merge results, or (None, None) if nothing is cached.
+    """
+    if not keys or not cache_limit():
+        return None, None
+    for n in range(len(keys) - 1, -1, -1):
+        meta = _read_entry(keys[n])
+        if meta is None:
+            continue
+        temp = paths.get('baselines', 'temp')
+        if os.path.exists(temp):
+            shutil.rmtree(temp)
+        linkfarm.link_tree(_cache_path(keys[n]), temp)
+        meta['used'] = time.time()
+        _write_entry(keys[n], meta)
+        log.i('Reusing cached merge of {} mods'.format(n))
+        return n, list(meta['statuses'])
+    return None, None
+
+def _unshared_size(key):
+    """Returns the number of bytes that entry <key> adds to the disk usage.
+
+    Files that are hard links to the baseline or to other entries take no
+    extra space, so only files with no other link are counted.  The links
+    still held by ``LNP/Baselines/temp`` are not counted as sharing, since
+    that folder is rebuilt for every merge."""
+    folder, temp = _cache_path(key), paths.get('baselines', 'temp')
+    size, seen = 0, set()
+    for root, _, files in os.walk(folder):
+        rel = os.path.relpath(root, folder)
+        for f in files:
+            st = os.stat(os.path.join(root, f))
+            links = st.st_nlink
+            if st.st_ino:
+                inode = (st.st_dev, st.st_ino)
+                if inode in seen:
+                    continue
+                seen.add(inode)
+                try:
+                    t = os.stat(os.path.join(temp, rel, f))
+                    if (t.st_dev, t.st_ino) == inode:
+                        links -= 1
+                except OSError:
+                    pass
+            if links <= 1:
+                size += st.st_size
+    return size
+
+def store(key, statuses):
+    """Stores the current contents of ``LNP/Baselines/temp`` under <key>.
+
+    Params:
+        key
+            the prefix key for the current merge state
+        statuses
+            a list of merge status ints for the merged mods
+    """
+    if not key or not cache_limit():
+        return
+    if _read_entry(key) is not None:
+        return
+    # pylint:disable=bare-except
+    try:
+        if os.path.isdir(_cache_path(key)):
+            shutil.rmtree(_cache_path(key))
+        linkfarm.link_tree(paths.get('baselines', 'temp'), _cache_path(key))
+        _write_entry(key, {
+            'statuses': statuses, 'size': _unshared_size(key),
+            'used': time.time()})
+    except:
+        log.w('Could not store merge in cache', stack=True)
+        return
+    evict()
+
+def evict(limit=None):
+    """Removes least recently used entries until the cache fits <limit> bytes.
+    Defaults to the configured cache size."""
+    if limit is None:
+        limit = cache_limit()
+    folder = _cache_path()
+    if not os.path.isdir(folder):
+        return
+    entries = []
+    for name in os.listdir(folder):
+        if name.endswith('.json'):
+            key = name[:-5]
+            meta = _read_entry(key)
+            if meta is None:
+                os.remove(_cache_path(name))
+            else:
+                entries.append((meta['used'], meta['size'], key))
+    entries.sort()
+    total = sum(e[1] for e in entries)
+    while entries and total > limit:
+        _, size, key = entries.pop(0)
+        log.d('Evicting merge cache entry ' + key)
+        os.remove(_cache_path(key + '.json'))
+        shutil.rmtree(_cache_path(key))
+        total -= size
+
+def clear():
+    """Removes all cached merges."""
+    if os.path.isdir(_cache_path()):
+        shutil.rmtree(_cache_path())
@@ -5,10 +5,13 @@ from __future__ import print_function, unicode_literals, absolute_import
 
 import sys, os, shutil, glob, time
 from difflib import ndiff, SequenceMatcher
+from multiprocessing.pool import ThreadPool
 # pylint:disable=redefined-builtin
 from io import open
 
-from . import paths, baselines, log, manifest
+from . import paths, archives, baselines, hashindex, linkfarm, log, manifest
+from . import dedup, mergecache, packplan, rawmerge
+from . import inventory as inventory_
 from .lnp import lnp
 
 def _shutil_wrap(fn):
@@ -29,6 +32,44 @@ if sys.platform == 'win32':
     shutil.rmtree = _shutil_wrap(shutil.rmtree)
     shutil.copytree = _shutil_wrap(shutil.copytree)
 
+# Journal of files changed by the mod currently being merged, if any
+_journal = None
+
+# Files captured from the installed raws, as merged by merge_folder
+CAPTURED_FILES = ('.txt', '.init', '.lua', '.rb', '.bmp', '.png')
+
+def _prepare_write(path, keep_contents=True):
+    """Call before changing a file in the merge folder. Records the file in
+    the merge journal, and detaches it from any files it is linked to."""
+    if _journal is not None:
+        _journal.record(path)
+    linkfarm.detach(path, keep_contents)
+
+def _replace_file(src, dst):
+    """Replaces a file in the merge folder with a link to, or copy of, src.
+    Files in zipped packs are streamed from the archive."""
+    if _journal is not None:
+        _journal.record(dst)
+    if archives.resolve_pack(src)[0] is not None:
+        if os.path.lexists(dst):
+            os.remove(dst)
+        elif not os.path.isdir(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        baselines.copy_file(src, dst)
+        return
+    linkfarm.replace_file(src, dst)
+
+def _install_raws(src, target):
+    """Installs the tree at <src> as <target>, and shares identical files
+    with other raw folders if enabled."""
+    linkfarm.install_tree(src, target, hardlink=will_link_raws())
+    if will_link_raws() and dedup.will_dedup_raws():
+        # pylint:disable=bare-except
+        try:
+            dedup.dedup_tree(target)
+        except:
+            log.w('Could not deduplicate ' + target, stack=True)
+
 def toggle_premerge_gfx():
     """Sets the option for pre-merging of graphics."""
     lnp.userconfig['premerge_graphics'] = not lnp.userconfig.get_bool(
@@ -39,11 +80,31 @@ def will_premerge_gfx():
     """Returns whether or not graphics will be merged prior to any mods."""
     return lnp.userconfig.get_bool('premerge_graphics')
 
+def toggle_object_merge():
+    """Sets the option for merging raw files object by object."""
+    lnp.userconfig['merge_objects'] = not will_merge_objects()
+    lnp.userconfig.save_data()
+
+def will_merge_objects():
+    """Returns whether raw object files are merged object by object, instead
+    of line by line."""
+    return lnp.userconfig.get_bool('merge_objects')
+
+def will_link_raws():
+    """Returns whether installed raws may be hard links to merged raws.
+
+    Installing raws then needs almost no disk space or time, but editing the
+    installed files in place outside PyLNP would also change the baseline,
+    mods or cached copies they are linked to, so this is off by default and
+    installed raws are reflinks or copies."""
+    return lnp.userconfig.get_value('link_installed_raws', False)
+
 def read_mods():
     """Returns a list of mod packs"""
-    return [os.path.basename(o) for o in glob.glob(paths.get('mods', '*'))
-            if os.path.isdir(o) and
-            manifest.is_compatible('mods', os.path.basename(o))]
+    names = [os.path.basename(o) for o in glob.glob(paths.get('mods', '*'))
+             if os.path.isdir(o)] + archives.zipped_packs('mods')
+    manifest.preload('mods', names)
+    return [n for n in names if manifest.is_compatible('mods', n)]
 
 def get_title(mod):
     """Returns the mod title; either per manifest or from dirname."""
@@ -56,75 +117,65 @@ def get_tooltip(mod):
     """Returns the tooltip for the given mod."""
     return manifest.get_cfg('mods', mod).get_string('tooltip')
 
-def simplify_mods():
+def simplify_mods(dry_run=False):
     """Removes unnecessary files from all mods."""
     mods, files = 0, 0
     for pack in read_mods():
         mods += 1
-        files += simplify_pack(pack)
+        files += simplify_pack(pack, dry_run)
     return mods, files
 
-def simplify_pack(pack):
+def simplify_pack(pack, dry_run=False):
     """Removes unnecessary files from one mod.
 
     Params:
         pack
             path segment in './LNP/Mods/pack/' as a string
+        dry_run
+            if True, only log the changes that would be made
 
     Returns:
         The sum of files affected by the operations
     """
+    log.i('Simplifying mods: ' + pack)
+    plan = packplan.plan_pack(pack, 'mods')
     # Here we use the heuristic that mods which are bundled with other files
     # contain a complete set of raws, and vanilla files which are missing
     # should not be inserted.  We thus add empty files to fill out the set in
     # cases where several files are removed.
-    # pylint: disable=redefined-variable-type
-    i = baselines.simplify_pack(pack, 'mods')
-    if not i:
-        i = 0
-    if i > 10:
+    if plan.count('unneeded') > 10:
         log.w('Reducing mod "{}": assume vanilla files were omitted '
               'deliberately'.format(pack))
-        i += make_blank_files(pack)
-    i += baselines.remove_vanilla_raws_from_pack(pack, 'mods')
-    i += baselines.remove_empty_dirs(pack, 'mods')
-    return i
-
-def make_blank_files(pack):
-    """Create blank files where vanilla files are missing.
-
-    Params:
-        pack
-            path segment in './LNP/folder/pack/' as strings
-
-    Returns:
-        The number of blank files created
-    """
-    i = 0
-    vanilla_raws = baselines.find_vanilla_raws()
-    for root, _, files in os.walk(vanilla_raws):
-        for k in files:
-            f = os.path.relpath(os.path.join(root, k), vanilla_raws)
-            if not os.path.isfile(paths.get('mods', pack, f)):
-                with open(paths.get('mods', pack, f), 'w') as blank:
-                    blank.write('')
-                    i += 1
-    return i
+        plan.add_blanks()
+    if dry_run:
+        for line in plan.report():
+            log.i(line)
+        return plan.changes()
+    return plan.apply()
 
 def install_mods():
-    """Deletes installed raw folder, and copies over merged raws."""
+    """Replaces installed raw folder with merged raws.
+
+    The previously installed raws are kept until the next install, and can
+    be restored with rollback_mods."""
     merge_log = paths.get('baselines', 'temp', 'raw', 'installed_raws.txt')
     if read_installation_log(merge_log):
-        shutil.rmtree(paths.get('df', 'raw'))
-        shutil.rmtree(paths.get('df', 'data', 'speech'))
-        shutil.copytree(paths.get('baselines', 'temp', 'raw'),
-                        paths.get('df', 'raw'))
-        shutil.copytree(paths.get('baselines', 'temp', 'data', 'speech'),
-                        paths.get('df', 'data', 'speech'))
+        _install_raws(paths.get('baselines', 'temp', 'raw'),
+                      paths.get('df', 'raw'))
+        _install_raws(paths.get('baselines', 'temp', 'data', 'speech'),
+                      paths.get('df', 'data', 'speech'))
         return True
     log.w('To avoid data loss, PyLNP only installs mods if a log exists')
     return False
 
+def rollback_mods():
+    """Restores the raws replaced by the last install, returning a bool."""
+    if linkfarm.rollback_tree(paths.get('df', 'raw')):
+        linkfarm.rollback_tree(paths.get('df', 'data', 'speech'))
+        log.i('Restored previously installed raws')
+        return True
+    return False
+
 def merge_all_mods(list_of_mods, gfx=None):
     """Merges the specified list of mods, starting with graphics if set to
     pre-merge (or if a pack is specified explicitly).
@@ -141,23 +192,40 @@ def merge_all_mods(list_of_mods, gfx=None):
             0:  Merge was successful, all well
             1:  Potential compatibility issues, no merge problems
             2:  Non-fatal error, overlapping lines or non-existent mod etc
-            3:  Fatal error, not returned (rebuilds to previous, rest unmerged)
+            3:  Fatal error, not returned (reverts to previous, rest unmerged)
+
+    Intermediate results are cached (see core.mergecache), so only mods
+    after the longest previously merged prefix of the list are merged again.
+    Files changed by each mod are journaled, so a fatal error only needs to
+    restore those files.
     """
+    # pylint:disable=global-statement
+    global _journal
     from . import graphics
-    clear_temp()
-    if gfx:
-        add_graphics(gfx)
-    elif will_premerge_gfx():
-        add_graphics(graphics.current_pack())
-    ret_list = []
-    for i, mod in enumerate(list_of_mods):
-        status = merge_a_mod(mod)
-        ret_list.append(status)
-        if status == 3:
-            log.i('Mod {}, in {}, could not be merged.'.format(
-                mod, str(list_of_mods)))
-            merged = merge_all_mods(list_of_mods[:i-1], gfx)
-            return merged + [-1]*len(list_of_mods[i:])
+    if not gfx and will_premerge_gfx():
+        gfx = graphics.current_pack()
+    keys = mergecache.prefix_keys(list_of_mods, gfx)
+    start, ret_list = mergecache.restore(keys)
+    if start is None:
+        clear_temp()
+        if gfx:
+            add_graphics(gfx)
+        start, ret_list = 0, []
+        mergecache.store(keys and keys[0], ret_list)
+    _journal = linkfarm.Journal(paths.get('baselines', 'journal'))
+    try:
+        for i, mod in enumerate(list_of_mods[start:], start):
+            status = merge_a_mod(mod)
+            if status == 3:
+                log.i('Mod {}, in {}, could not be merged.'.format(
+                    mod, str(list_of_mods)))
+                _journal.restore()
+                return ret_list + [-1]*len(list_of_mods[i:])
+            _journal.checkpoint()
+            ret_list.append(status)
+            mergecache.store(keys and keys[i+1], ret_list)
+    finally:
+        _journal = None
     return ret_list
 
 def merge_a_mod(mod):
@@ -169,24 +237,29 @@ def merge_a_mod(mod):
         3:  Fatal error, respond by rebuilding to previous mod
         """
     log.push_prefix('In "' + mod + '": ')
-    if not baselines.find_vanilla_raws():
+    vanilla = baselines.find_vanilla()
+    if not vanilla:
         log.e('Could not merge: baseline raws unavailable')
         return 3
     log.d('Starting to merge mod: {}'.format(mod))
+    for tree in (paths.get('mods', mod), vanilla,
+                 paths.get('baselines', 'temp')):
+        hashindex.get(tree)
     mod_raw_folder = paths.get('mods', mod, 'raw')
-    if not os.path.isdir(mod_raw_folder):
+    if not baselines.isdir(mod_raw_folder):
         log.w('mod is invalid; /raw/ must be a directory')
         return 2
-    status = merge_folder(mod_raw_folder, baselines.find_vanilla_raws(),
+    status = merge_folder(mod_raw_folder, os.path.join(vanilla, 'raw'),
                           paths.get('baselines', 'temp', 'raw'))
-    if os.path.isdir(paths.get('mods', mod, 'data', 'speech')):
+    if baselines.isdir(paths.get('mods', mod, 'data', 'speech')):
         status = max(status, merge_folder(
             paths.get('mods', mod, 'data', 'speech'),
-            os.path.join(baselines.find_vanilla(), 'data', 'speech'),
+            os.path.join(vanilla, 'data', 'speech'),
             paths.get('baselines', 'temp', 'data', 'speech')))
     if status < 3:
-        with open(paths.get('baselines', 'temp', 'raw', 'installed_raws.txt'),
-                  'a') as f:
+        merge_log = paths.get('baselines', 'temp', 'raw', 'installed_raws.txt')
+        _prepare_write(merge_log)
+        with open(merge_log, 'a') as f:
             f.write('mods/' + mod + '\n')
     log.i('Finished merging')
     log.pop_prefix()
@@ -194,9 +267,10 @@ def merge_a_mod(mod):
 
 def merge_folder(mod_folder, vanilla_folder, mixed_folder):
     """Merge the specified folders, output going in 'LNP/Baselines/temp'
-    Text files are merged; other files (sprites etc) are copied over."""
+    Text files are merged; other files (sprites etc) are copied over.
+    <mod_folder> may be in a zipped pack."""
     status = 0
-    for root, _, files in os.walk(mod_folder):
+    for root, _, files in baselines.walk(mod_folder):
         for k in files:
             f = os.path.relpath(os.path.join(root, k), mod_folder)
             log.push_prefix('file "' + f + '": ')
@@ -209,19 +283,12 @@ def merge_folder(mod_folder, vanilla_folder, mixed_folder):
                 status = max(status, merge_file(mod_f, van_f, gen_f))
             elif any([f.endswith(a) for a in ('.lua', '.rb', '.bmp', '.png')]):
                 # copy DFHack scripts or sprite sheets
-                if not os.path.isdir(os.path.dirname(gen_f)):
-                    os.makedirs(os.path.dirname(gen_f))
                 if not os.path.isfile(gen_f):
-                    shutil.copy2(mod_f, gen_f)
+                    _replace_file(mod_f, gen_f)
                     status = max(1, status)
-                else:
-                    with open(mod_f, 'rb') as f:
-                        mb = f.read() # pylint:disable=no-member
-                    with open(gen_f, 'rb') as f:
-                        gb = f.read() # pylint:disable=no-member
-                    if mb != gb:
-                        shutil.copyfile(mod_f, gen_f)
-                        status = max(2, status)
+                elif not baselines.same_contents(mod_f, gen_f):
+                    _replace_file(mod_f, gen_f)
+                    status = max(2, status)
             log.d('merged with status {}'.format(status))
             log.pop_prefix()
     return status
@@ -235,17 +302,43 @@ def merge_file(mod_file_name, van_file_name, gen_file_name):
         3:  Fatal error, respond by rebuilding to previous mod
     """
     #pylint:disable=bare-except
+    if baselines.isfile(van_file_name) and os.path.isfile(gen_file_name):
+        # Shortcuts for identical files, using content hashes
+        if baselines.same_contents(mod_file_name, van_file_name):
+            log.d('mod file identical to vanilla file')
+            return 0
+        if baselines.same_contents(mod_file_name, gen_file_name):
+            log.d('changes are identical to a previously merged mod')
+            return 0
+        if baselines.same_contents(gen_file_name, van_file_name):
+            log.d('no overlap with previous mods, replacing vanilla file')
+            try:
+                _replace_file(mod_file_name, gen_file_name)
+                return 0
+            except:
+                log.e('Writing to {} failed'.format(gen_file_name))
+                return 3
     van_lines, mod_lines, gen_lines = [], [], []
     for fname, lines in ((van_file_name, van_lines),
                          (mod_file_name, mod_lines),
                          (gen_file_name, gen_lines)):
         try:
-            with open(fname, encoding='cp437', errors='replace') as f:
+            with baselines.open_text(fname, errors='replace') as f:
                 lines.extend(f.readlines())
         except IOError:
             log.d(fname + ' cannot be read; merging other files')
-    status, gen_lines = merge_line_list(mod_lines, van_lines, gen_lines)
+    old_lines, result = gen_lines, None
+    if will_merge_objects():
+        result = rawmerge.merge_object_lists(
+            mod_lines, van_lines, gen_lines, merge_line_list)
+    if result is None:
+        result = merge_line_list(mod_lines, van_lines, gen_lines)
+    status, gen_lines = result
+    if gen_lines == old_lines and os.path.isfile(gen_file_name):
+        log.d('merged file unchanged')
+        return status
     try:
+        _prepare_write(gen_file_name, keep_contents=False)
         with open(gen_file_name, "w", encoding='cp437') as gen_file:
             gen_file.writelines(gen_lines)
     except:
@@ -359,21 +452,25 @@ def three_way_merge(gen_text, van_gen_ops, mod_text, van_mod_ops):
     yield [status]
 
 def clear_temp():
-    """Resets the folder in which raws are mixed."""
-    if not baselines.find_vanilla_raws(False):
+    """Resets the folder in which raws are mixed.
+
+    The folder is built as a link farm of the baseline (see core.linkfarm),
+    so files are only copied when a merge writes to them."""
+    vanilla = baselines.find_vanilla(False)
+    if not vanilla:
         log.e('Could not clear temp: baseline raws unavailable')
         return
     if os.path.exists(paths.get('baselines', 'temp')):
         shutil.rmtree(paths.get('baselines', 'temp'))
-    shutil.copytree(baselines.find_vanilla_raws(),
-                    paths.get('baselines', 'temp', 'raw'))
-    shutil.rmtree(paths.get('baselines', 'temp', 'raw', 'graphics'))
-    shutil.copytree(os.path.join(baselines.find_vanilla(), 'data', 'speech'),
-                    paths.get('baselines', 'temp', 'data', 'speech'))
+    baselines.seed_tree(os.path.join(vanilla, 'raw'),
+                        paths.get('baselines', 'temp', 'raw'),
+                        ignore=('graphics', 'installed_raws.txt'))
+    baselines.seed_tree(os.path.join(vanilla, 'data', 'speech'),
+                        paths.get('baselines', 'temp', 'data', 'speech'))
     with open(paths.get('baselines', 'temp', 'raw', 'installed_raws.txt'),
               'w') as f:
         f.write('# List of raws merged by PyLNP:\nbaselines/' +
-                os.path.basename(baselines.find_vanilla()) + '\n')
+                os.path.basename(vanilla) + '\n')
 
 def update_raw_dir(path, gfx=('', '')):
     """Updates a raw dir in place with specified graphics and raws.
@@ -393,34 +490,120 @@ def update_raw_dir(path, gfx=('', '')):
         if -1 in merge_all_mods(mods_list, gfx[0]):
             log.w('Some mods in {} could not be remerged'.format(path))
             return False
-    shutil.rmtree(path)
-    shutil.copytree(paths.get('baselines', 'temp', 'raw'), path)
+    _install_raws(paths.get('baselines', 'temp', 'raw'), path)
     return True
 
+def install_raw_dirs(targets):
+    """Installs the merged raws into each folder in <targets> in parallel.
+    Returns the number of folders updated."""
+    def _install(path):
+        # pylint:disable=bare-except, missing-docstring
+        try:
+            _install_raws(paths.get('baselines', 'temp', 'raw'), path)
+            log.i('Updated raws in ' + path)
+            return True
+        except:
+            log.e('Could not update raws in ' + path, stack=True)
+            return False
+    if not targets:
+        return 0
+    pool = ThreadPool(min(len(targets), 4))
+    try:
+        return sum(pool.map(_install, targets))
+    finally:
+        pool.close()
+        pool.join()
+
 def add_graphics(gfx):
     """Adds graphics to the mod merge in baselines/temp."""
     from . import graphics
     gfx_raws = paths.get('graphics', gfx, 'raw')
-    for root, _, files in os.walk(gfx_raws):
+    for root, _, files in baselines.walk(gfx_raws):
         dst = paths.get('baselines', 'temp', 'raw',
                         os.path.relpath(root, gfx_raws))
         if not os.path.isdir(dst):
             os.makedirs(dst)
         for f in files:
-            shutil.copy2(os.path.join(root, f), dst)
-    with open(paths.get('baselines', 'temp', 'raw', 'installed_raws.txt'),
-              'a') as f:
+            _replace_file(os.path.join(root, f), os.path.join(dst, f))
+    merge_log = paths.get('baselines', 'temp', 'raw', 'installed_raws.txt')
+    _prepare_write(merge_log)
+    with open(merge_log, 'a') as f:
         f.write('graphics/{}\n'.format(graphics.get_folder_prefix(gfx)))
     log.i('{} graphics added (small mod compatibility risk)'.format(gfx))
 
-def can_rebuild(log_file, strict=True):
-    """Test if user can exactly rebuild a raw folder, returning a bool."""
+def can_rebuild(log_file, strict=True, inventory=None):
+    """Test if user can exactly rebuild a raw folder, returning a bool.
+
+    Params:
+        log_file
+            the installed_raws.txt describing the raw folder
+        strict
+            the result if <log_file> does not exist is (not strict)
+        inventory
+            the inventory.Inventory snapshot to check against, if any
+    """
     if not os.path.isfile(log_file):
         guess = not strict
         log.w('{} not found; assume rebuildable = {}'.format(log_file, guess))
         return guess
     mod_list = read_installation_log(log_file)
-    return all([m in read_mods() for m in mod_list])
+    available = inventory_.snapshot(inventory).mod_set
+    return all(m in available for m in mod_list)
+
+def _reconstruct_installed():
+    """Rebuilds the raws described by the installation log from the available
+    mods, reusing cached merges.
+
+    Returns:
+        The folder holding the reconstruction (LNP/Baselines/temp, or the
+        vanilla baseline if no logged mods are available), or None if the
+        baseline is unavailable
+    """
+    vanilla = baselines.find_vanilla()
+    if not vanilla:
+        return None
+    installed = get_installed_mods_from_log()
+    if not installed:
+        return vanilla
+    merge_all_mods(installed)
+    return paths.get('baselines', 'temp')
+
+def find_installed_changes():
+    """Compares the installed raws to their reconstruction from the
+    installation log, using content hashes.
+
+    Returns:
+        A list of tuple(installed file, '/'-separated path in a mod) for the
+        files that differ from both the reconstruction and vanilla, or None
+        if the baseline is unavailable
+    """
+    reconstruction = _reconstruct_installed()
+    if reconstruction is None:
+        return None
+    vanilla = baselines.find_vanilla()
+    hashindex.get(vanilla)
+    changes = []
+    for sub in ('raw', 'data/speech'):
+        folder = paths.get('df', *sub.split('/'))
+        if not os.path.isdir(folder):
+            continue
+        for rel in sorted(hashindex.get(folder).refresh()):
+            name = rel.rsplit('/', 1)[-1]
+            if name in packplan.JUNK_FILES or not any(
+                    name.endswith(a) for a in CAPTURED_FILES):
+                continue
+            live_f = os.path.join(folder, *rel.split('/'))
+            rec_f = os.path.join(reconstruction, *(sub + '/' + rel).split('/'))
+            van_f = os.path.join(vanilla, *(sub + '/' + rel).split('/'))
+            if baselines.same_contents(rec_f, live_f):
+                continue
+            if baselines.isfile(van_f) and baselines.matches_vanilla(
+                    van_f, live_f):
+                continue
+            changes.append((live_f, sub + '/' + rel))
+    log.d('{} installed files differ from the reconstruction'.format(
+        len(changes)))
+    return changes
 
 def make_mod_from_installed_raws(name):
     """Capture whatever unavailable mods a user currently has installed
@@ -428,39 +611,49 @@ def make_mod_from_installed_raws(name):
 
         * If ``installed_raws.txt`` is not present, compare to vanilla
         * Otherwise, rebuild as much as possible then compare to installed
+
+    Only files that differ are written to the new mod.  If <name> is empty,
+    nothing is written.
+
+    Returns:
+        True if there are changes to capture (and they were captured),
+        False if a mod called <name> already exists,
+        None if there is nothing to capture
     """
-    if get_installed_mods_from_log():
-        clear_temp()
-        for mod in get_installed_mods_from_log():
-            merge_a_mod(mod)
-        reconstruction = paths.get('baselines', 'temp2')
-        shutil.copytree(paths.get('baselines', 'temp'), reconstruction)
-    else:
-        reconstruction = baselines.find_vanilla()
-        if not reconstruction:
-            return
-    clear_temp()
-    merge_folder(os.path.join(reconstruction, 'raw'),
-                 paths.get('df', 'raw'),
-                 paths.get('baselines', 'temp', 'raw'))
-    merge_folder(os.path.join(reconstruction, 'data', 'speech'),
-                 paths.get('df', 'data', 'speech'),
-                 paths.get('baselines', 'temp', 'data', 'speech'))
-    baselines.simplify_pack('temp', 'baselines')
-    baselines.remove_vanilla_raws_from_pack('temp', 'baselines')
-    baselines.remove_empty_dirs('temp', 'baselines')
-    if os.path.isdir(paths.get('baselines', 'temp2')):
-        shutil.rmtree(paths.get('baselines', 'temp2'))
-    if name and os.path.isdir(paths.get('baselines', 'temp')):
-        if os.path.isdir(paths.get('mods', name)):
-            return False
-        shutil.copytree(paths.get('baselines', 'temp'), paths.get('mods', name))
-        return True
+    if name and (os.path.isdir(paths.get('mods', name)) or
+                 archives.pack_archive('mods', name)):
+        return False
+    changes = find_installed_changes()
+    if not changes:
+        return None
+    if name:
+        target = paths.get('mods', name)
+        for live_f, rel in changes:
+            dst = os.path.join(target, *rel.split('/'))
+            if not os.path.isdir(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            shutil.copy2(live_f, dst)
+        log.i('Captured {} installed files as mod {}'.format(
+            len(changes), name))
+    return True
 
-def get_installed_mods_from_log():
-    """Return best mod load order to recreate installed with available."""
+def get_installed_mods_from_log(inventory=None):
+    """Return best mod load order to recreate installed with available.
+    Checks availability against <inventory>, or a new snapshot if None."""
     logged = read_installation_log(paths.get('df', 'raw', 'installed_raws.txt'))
-    return [mod for mod in logged if mod in read_mods()]
+    available = inventory_.snapshot(inventory).mod_set
+    return [mod for mod in logged if mod in available]
+
+def read_log_signature(fname):
+    """Returns a tuple of the raws listed in an 'installed_raws.txt', which is
+    equal for all logs that describe the same raws, or None if the log can't
+    be read."""
+    try:
+        with open(fname) as f:
+            return tuple(l.strip() for l in f.readlines()
+                         if l.strip() and not l.startswith('#'))
+    except IOError:
+        return None
 
 def read_installation_log(fname):
     """Read an 'installed_raws.txt' and return the mods."""
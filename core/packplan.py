@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Plans and applies the simplification of mods and graphics packs.
+
+Simplifying a pack removes files that are not needed, files identical to
+the vanilla raws and the folders left empty, and may fill in blank files
+where vanilla raws are missing.  plan_pack decides all of this in a single
+walk of the pack, so the result can be reported before anything changes;
+Plan.apply then makes the changes.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os
+
+from . import baselines, helpers, log, paths
+
+# Files removed from raw folders without comparing them to vanilla
+JUNK_FILES = ('Thumbs.db', 'installed_raws.txt')
+# Folders compared to the same folders in the vanilla baseline
+VANILLA_FOLDERS = ('raw', 'data/speech')
+
+class KeepTrie(object):
+    """Prefix tree of the paths kept in a pack (see baselines.keep_patterns).
+
+    Nodes are dicts of path components; KEEP_ALL stands for a node below
+    which everything is kept."""
+    KEEP_ALL = True
+
+    def __init__(self, patterns):
+        """Constructor for KeepTrie.
+
+        Params:
+            patterns
+                '/'-separated paths of the files and folders to keep
+        """
+        self.root = {}
+        for pattern in patterns:
+            node = self.root
+            parts = [os.path.normcase(p) for p in pattern.split('/')]
+            for part in parts[:-1]:
+                if node.get(part) is self.KEEP_ALL:
+                    break
+                node = node.setdefault(part, {})
+            else:
+                node[parts[-1]] = self.KEEP_ALL
+
+    def child(self, node, name):
+        """Returns the node for <name> in the folder with <node>, or None if
+        nothing below it is kept."""
+        if node is self.KEEP_ALL:
+            return node
+        return node.get(os.path.normcase(name))
+
+    def keeps(self, node, name):
+        """Returns True if the file <name> in the folder with <node> is
+        kept."""
+        if name == 'manifest.json' or 'readme' in name.lower():
+            return True
+        return self.child(node, name) is self.KEEP_ALL
+
+class Plan(object):
+    """Changes to make to a pack; see plan_pack."""
+    def __init__(self, root):
+        """Constructor for Plan.
+
+        Params:
+            root
+                the pack folder
+        """
+        self.root = root
+        self.files = 0
+        self.delete = []
+        self.blank = []
+        self.prune = []
+        self.present = set()
+
+    def count(self, reason=None):
+        """Returns the number of files to delete for <reason> ('unneeded',
+        'vanilla' or 'junk'), or all files to delete if <reason> is None."""
+        return len([r for _, r in self.delete if reason in (None, r)])
+
+    def changes(self):
+        """Returns the number of files to delete or blank and folders to
+        remove."""
+        return len(self.delete) + len(self.blank) + len(self.prune)
+
+    def add_blanks(self):
+        """Adds blank files for vanilla raws that are missing from the pack,
+        so that omitted files do not fall back to vanilla when merged."""
+        vanilla_raws = baselines.find_vanilla_raws()
+        if not vanilla_raws:
+            return
+        for root, _, files in baselines.walk(vanilla_raws):
+            rel = os.path.relpath(root, vanilla_raws).replace(os.sep, '/')
+            for k in files:
+                f = 'raw/' + k if rel == '.' else 'raw/' + rel + '/' + k
+                if f not in self.present:
+                    self.blank.append(f)
+        self.prune = [d for d in self.prune
+                      if not any(b.startswith(d + '/') for b in self.blank)]
+
+    def report(self):
+        """Returns a list of lines describing the planned changes."""
+        lines = ['{}: {} files, {} to delete, {} to blank, {} folders to '
+                 'remove'.format(self.root, self.files, self.count(),
+                                 len(self.blank), len(self.prune))]
+        lines += ['  delete ({}): {}'.format(r, f) for f, r in self.delete]
+        lines += ['  blank: ' + f for f in self.blank]
+        lines += ['  remove folder: ' + d for d in self.prune]
+        return lines
+
+    def apply(self):
+        """Makes the planned changes.
+
+        Returns:
+            The number of files deleted or blanked and folders removed
+        """
+        def _path(rel):
+            # pylint:disable=missing-docstring
+            return os.path.join(self.root, *rel.split('/'))
+        for f, _ in self.delete:
+            os.remove(_path(f))
+        for f in self.blank:
+            if not os.path.isdir(os.path.dirname(_path(f))):
+                os.makedirs(os.path.dirname(_path(f)))
+            with open(_path(f), 'w') as blank:
+                blank.write('')
+        for d in self.prune:
+            os.rmdir(_path(d))
+        log.v('Simplified {}: deleted {}, blanked {}, removed {} '
+              'folders'.format(self.root, self.count(), len(self.blank),
+                               len(self.prune)))
+        return self.changes()
+
+def plan_pack(pack, folder):
+    """Plans the simplification of LNP/<folder>/<pack>.
+
+    Args:
+        pack, folder: path segments in ``'./LNP/folder/pack/'`` as strings
+
+    Returns:
+        a Plan
+    """
+    plan = Plan(paths.get(folder, pack))
+    trie = KeepTrie(baselines.keep_patterns(folder))
+    vanilla = baselines.find_vanilla()
+
+    def visit(rel, node):
+        """Plans changes in the folder <rel>; returns True if it will be
+        empty afterwards."""
+        dirs, files = helpers.list_dir(os.path.join(plan.root, *rel.split('/'))
+                                if rel else plan.root)
+        empty = True
+        for k in files:
+            f = rel + '/' + k if rel else k
+            plan.files += 1
+            compared = vanilla and any(
+                f.startswith(v + '/') for v in VANILLA_FOLDERS)
+            if not trie.keeps(node, k):
+                plan.delete.append((f, 'unneeded'))
+                continue
+            plan.present.add(f)
+            if compared and k in JUNK_FILES:
+                plan.delete.append((f, 'junk'))
+            elif compared and baselines.isfile(
+                    os.path.join(vanilla, *f.split('/'))) and \
+                    baselines.matches_vanilla(
+                        os.path.join(vanilla, *f.split('/')),
+                        os.path.join(plan.root, *f.split('/'))):
+                plan.delete.append((f, 'vanilla'))
+            else:
+                empty = False
+        for d in dirs:
+            sub = rel + '/' + d if rel else d
+            child = trie.child(node, d)
+            if visit(sub, child if child is not None else {}):
+                plan.prune.append(sub)
+            else:
+                empty = False
+        return empty
+
+    if os.path.isdir(plan.root):
+        visit('', trie.root)
+    return plan
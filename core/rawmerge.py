@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Object-aware merging of raw files.
+
+Raw object files are split into a header and a sequence of objects, each
+identified by its type and id (eg ``CREATURE:DWARF``), using the object
+types known to core.dfraw.  Objects are then merged one by one: objects only
+changed by one side are taken as-is, and only objects changed by both the mod
+and earlier mods are merged tag by tag.  Two mods editing different objects
+in the same file therefore never conflict.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import re
+from difflib import SequenceMatcher
+from fnmatch import fnmatch
+
+from . import log
+from .dfraw import object_parents
+
+_first_tag = re.compile(r'^\s*\[([^\]:]+):([^\]]*)\]')
+_tag_tokens = re.compile(r'[^\[]*\[[^\]]*\]?|[^\[]+')
+
+def split_objects(lines):
+    """Splits the lines of a raw object file into its header and objects.
+
+    Params:
+        lines
+            the lines of the file, including line endings
+
+    Returns:
+        tuple(header, objects), where header is a list of lines and objects
+        an ordered list of (key, lines) tuples; or None if the file has no
+        objects or an object id occurs more than once.
+    """
+    header, objects, keys, patterns = [], [], set(), []
+    current = header
+    for line in lines:
+        match = _first_tag.match(line)
+        if match:
+            name, value = match.group(1), match.group(2)
+            if name == 'OBJECT':
+                patterns = object_parents.get(value, [])
+            elif any(fnmatch(name, p) for p in patterns):
+                key = name + ':' + value
+                if key in keys:
+                    return None
+                keys.add(key)
+                current = []
+                objects.append((key, current))
+        current.append(line)
+    if not objects:
+        return None
+    return header, objects
+
+def _changes(old, new):
+    """Returns a list of (i1, i2, replacement) for the changes that turn
+    the sequence <old> into <new>, where old[i1:i2] is replaced."""
+    return [(i1, i2, tuple(new[j1:j2])) for tag, i1, i2, j1, j2 in
+            SequenceMatcher(None, old, new, autojunk=False).get_opcodes()
+            if tag != 'equal']
+
+def merge_tokens(mod_tokens, van_tokens, gen_tokens):
+    """Three-way merges sequences of tokens.
+
+    Changes made by only one side are applied.  Where changes by both sides
+    touch the same tokens, insertions at the same place are all kept
+    (earlier mods first, status 1); otherwise the mod's version of that
+    part replaces the earlier mods' version (status 2).
+
+    Returns:
+        tuple(status, tokens)
+    """
+    mod_c, gen_c = set(_changes(van_tokens, mod_tokens)), set(
+        _changes(van_tokens, gen_tokens))
+    changes = sorted([c + ('mod',) for c in mod_c] +
+                     [c + ('gen',) for c in gen_c - mod_c])
+    # Group changes whose ranges touch, so that each group is merged alone
+    groups = []
+    for change in changes:
+        if groups and change[0] <= groups[-1][1]:
+            groups[-1][1] = max(groups[-1][1], change[1])
+            groups[-1][2].append(change)
+        else:
+            groups.append([change[0], change[1], [change]])
+    status, result, pos = 0, [], 0
+    for start, end, group in groups:
+        result.extend(van_tokens[pos:start])
+        sides = set(c[3] for c in group)
+        if len(sides) > 1 and all(c[:2] == (start, start) for c in group):
+            # Additions at the same place by both sides
+            status = max(status, 1)
+            group = [c for c in group if c[3] == 'gen'] + [
+                c for c in group if c[3] == 'mod']
+            for c in group:
+                result.extend(c[2])
+            pos = end
+            continue
+        if len(sides) > 1:
+            status = 2
+            group = [c for c in group if c[3] == 'mod']
+        pos = start
+        for i1, i2, replacement, _ in group:
+            result.extend(van_tokens[pos:i1])
+            result.extend(replacement)
+            pos = i2
+        result.extend(van_tokens[pos:end])
+        pos = end
+    result.extend(van_tokens[pos:])
+    return status, result
+
+def _merge_tags(key, mod_lines, van_lines, gen_lines):
+    """Merges an object changed by both the mod and earlier mods, treating
+    each tag (with the whitespace before it) as one token."""
+    def tokens(lines):
+        # pylint:disable=missing-docstring
+        return _tag_tokens.findall(''.join(lines))
+    status, merged = merge_tokens(
+        tokens(mod_lines), tokens(van_lines), tokens(gen_lines))
+    if status > 1:
+        log.w('Object {} was changed by this and an earlier mod; '
+              'overlapping tags were overwritten'.format(key))
+    return status, ''.join(merged).splitlines(True)
+
+def merge_object_lists(mod_text, vanilla_text, gen_text, line_merge):
+    """Merges sequences of lines object by object.
+
+    Params:
+        mod_text
+            The lines of the mod file being added to the merge.
+        vanilla_text
+            The lines of the corresponding vanilla file.
+        gen_text
+            The lines of the previously merged file or files.
+        line_merge
+            function used to merge headers, with the signature and
+            return value of core.mods.merge_line_list
+
+    Returns:
+        tuple(status, lines) as for core.mods.merge_line_list,
+        or None if the files can't be merged by object.
+    """
+    parsed = [split_objects(t) for t in (mod_text, vanilla_text, gen_text)]
+    if None in parsed:
+        return None
+    (mod_h, mod_o), (van_h, van_o), (gen_h, gen_o) = parsed
+    status, header = 0, gen_h
+    if mod_h != van_h and mod_h != gen_h:
+        status, header = line_merge(mod_h, van_h, gen_h)
+    mod_d, van_d, gen_d = dict(mod_o), dict(van_o), dict(gen_o)
+    merged = {}
+    for key in set(mod_d) | set(gen_d):
+        mod_obj, van_obj, gen_obj = (
+            mod_d.get(key), van_d.get(key), gen_d.get(key))
+        if mod_obj == van_obj or mod_obj == gen_obj:
+            merged[key] = gen_obj
+        elif gen_obj == van_obj:
+            merged[key] = mod_obj
+        elif mod_obj is None or gen_obj is None or van_obj is None:
+            # Removed by one side and changed by the other, or added by both
+            log.w('Object {} was changed by this and an earlier mod; '
+                  'replaced by this mod'.format(key))
+            status = max(status, 2)
+            merged[key] = mod_obj
+        else:
+            s, merged[key] = _merge_tags(key, mod_obj, van_obj, gen_obj)
+            status = max(status, s)
+    # Keep the order of earlier mods, adding new objects after their
+    # predecessor in the mod file, or first if they have none
+    order = [k for k, _ in gen_o]
+    placed, last = set(order), None
+    for key, _ in mod_o:
+        if key not in placed:
+            order.insert(0 if last is None else order.index(last) + 1, key)
+            placed.add(key)
+        last = key
+    lines = list(header)
+    for key in order:
+        if merged.get(key) is not None:
+            lines.extend(merged[key])
+    return status, lines
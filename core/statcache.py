@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Helpers for the caches that PyLNP keeps on disk.
+
+Cached entries are checked against the stat signature (modification time
+and size) of the files they were built from, and caches are saved as JSON
+objects tagged with a format version, so that caches saved in another
+format are discarded and rebuilt.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os, json
+
+from . import log
+
+def signature(path):
+    """Returns [mtime, size] for <path>, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+def load(filename, version):
+    """Returns the dict saved in <filename> by save() with <version>, or None
+    if the file is missing, unreadable or in another format."""
+    try:
+        with open(filename, 'rb') as f:
+            data = json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('version') != version:
+        return None
+    return data
+
+def save(filename, version, data):
+    """Saves the dict <data> in <filename>, tagged with <version>.  Failures
+    are logged and otherwise ignored, since the cache can be rebuilt.
+
+    Returns:
+        True if the cache was saved
+    """
+    try:
+        text = json.dumps(dict(data, version=version))
+        with open(filename, 'wb') as f:
+            f.write(text.encode('utf-8'))
+    except (IOError, OSError, TypeError, ValueError):
+        log.d('Could not save cache ' + filename)
+        return False
+    return True
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Index of the tilesets installed in data/art.
+
+The index records the name, size in pixels (read from the image header),
+source, content hash and companion files of each tileset, and is saved in
+``LNP/Tilesets/.index.json``.  Images are only read again when their stat
+signature changes.  Tilesets from LNP/Tilesets are copied into data/art when
+the contents of LNP/Tilesets change, rather than on every listing.
+"""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os, shutil, struct
+from threading import Lock
+
+from . import paths, hashindex, log, statcache
+from .lnp import lnp
+
+# Saved index format; indexes saved in another format are rebuilt
+INDEX_VERSION = 1
+# Files in data/art that are not tilesets
+NOT_TILESETS = (
+    'transparent1px.png', 'white1px.png', 'shadows.png', 'mouse.', '_')
+# Suffixes of the images drawn with a tileset by TwbT
+COMPANIONS = ('-bg.png', '-top.png')
+
+def image_size(path):
+    """Returns (width, height) from the header of the PNG or BMP image at
+    <path>, or (None, None) if it can't be read."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(26)
+    except (IOError, OSError):
+        return None, None
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and len(header) >= 24:
+        return struct.unpack(str('>II'), header[16:24])
+    if header[:2] == b'BM' and len(header) >= 26:
+        width, height = struct.unpack(str('<ii'), header[18:26])
+        return width, abs(height)
+    return None, None
+
+class TilesetLibrary(object):
+    """Cached index of the tilesets in an art folder."""
+    def __init__(self, art, source):
+        """Constructor for TilesetLibrary.
+
+        Params:
+            art
+                the folder DF loads tilesets from
+            source
+                the folder of tilesets to copy into <art>
+        """
+        self.art = art
+        self.source = source
+        self.filename = os.path.join(source, '.index.json')
+        self.lock = Lock()
+        self.current = False
+        data = statcache.load(self.filename, INDEX_VERSION) or {}
+        self.entries = data.get('tilesets', {})
+        self.source_sig = data.get('source')
+
+    def _source_signature(self):
+        """Returns the stat signatures of the items in the source folder."""
+        if not os.path.isdir(self.source):
+            return {}
+        return dict((k, statcache.signature(os.path.join(self.source, k)))
+                    for k in os.listdir(self.source) if not k.startswith('.'))
+
+    def sync(self):
+        """Copies tilesets that changed in the source folder since the last
+        sync, or are missing from the art folder.
+
+        Returns:
+            The number of items copied
+        """
+        with self.lock:
+            return self._sync()
+
+    def _sync(self):
+        """Implements sync; the lock must be held."""
+        sig = self._source_signature()
+        old = self.source_sig or {}
+        count = 0
+        for k in sorted(sig):
+            src, dst = os.path.join(self.source, k), os.path.join(self.art, k)
+            if old.get(k) == sig[k] and os.path.exists(dst):
+                continue
+            if os.path.isfile(src):
+                if hashindex.same_contents(src, dst):
+                    continue
+                if not os.path.isdir(self.art):
+                    os.makedirs(self.art)
+                shutil.copy2(src, dst)
+            else:
+                if os.path.isdir(dst):
+                    shutil.rmtree(dst)
+                shutil.copytree(src, dst)
+            count += 1
+        if count:
+            log.i('Copied {} items from {} to {}'.format(
+                count, self.source, self.art))
+        if sig != self.source_sig:
+            self.source_sig = sig
+            self.save()
+        return count
+
+    def _build(self, name, sig):
+        """Returns a new index entry for the tileset <name>."""
+        path = os.path.join(self.art, name)
+        width, height = image_size(path)
+        source = os.path.join(self.source, name)
+        return {
+            'sig': sig, 'width': width, 'height': height,
+            'hash': hashindex.hash_file(path),
+            'source': 'tilesets' if hashindex.same_contents(
+                source, path) else 'art',
+            'companions': []}
+
+    def refresh(self):
+        """Syncs tilesets from the source folder if it changed, and brings the
+        index up to date with the art folder.
+
+        Returns:
+            dict mapping file names to index entries
+        """
+        with self.lock:
+            self._sync()
+            names = set()
+            if os.path.isdir(self.art):
+                names = set(k for k in os.listdir(self.art) if os.path.splitext(
+                    k)[1].lower() in ('.bmp', '.png'))
+            changed = False
+            for name in names:
+                sig = statcache.signature(os.path.join(self.art, name))
+                entry = self.entries.get(name)
+                if entry is None or entry['sig'] != sig:
+                    log.d('Updating tileset index entry for ' + name)
+                    self.entries[name] = self._build(name, sig)
+                    changed = True
+            for name in set(self.entries) - names:
+                del self.entries[name]
+                changed = True
+            for name, entry in self.entries.items():
+                base = os.path.splitext(name)[0]
+                companions = [base + c for c in COMPANIONS]
+                if not all(c in names for c in companions):
+                    companions = []
+                if entry['companions'] != companions:
+                    entry['companions'] = companions
+                    changed = True
+            if changed:
+                self.save()
+            self.current = True
+            return dict(self.entries)
+
+    def save(self):
+        """Saves the index, if the source folder exists."""
+        if os.path.isdir(self.source):
+            statcache.save(self.filename, INDEX_VERSION, {
+                'source': self.source_sig, 'tilesets': self.entries})
+
+    def names(self):
+        """Returns a sorted tuple of the tilesets that can be selected, which
+        excludes companion images and, for legacy DF, PNG files."""
+        entries = self.refresh()
+        companions = set(c for e in entries.values() for c in e['companions'])
+        legacy = 'legacy' in lnp.df_info.variations
+        return tuple(sorted(
+            k for k in entries if k not in companions and
+            not (legacy and k.lower().endswith('.png')) and
+            not any(k.startswith(a) for a in NOT_TILESETS)))
+
+    def get(self, name):
+        """Returns the entry for the tileset <name>, without refreshing the
+        index if it is current, or None if there is no such tileset."""
+        with self.lock:
+            entry = self.entries.get(name) if self.current else None
+        if entry is None:
+            entry = self.refresh().get(name)
+        return entry
+
+    def invalidate(self):
+        """Marks the index as out of date, eg. after changing the art folder,
+        so that get() checks it again."""
+        with self.lock:
+            self.current = False
+
+_library = None
+
+def library():
+    """Returns the tileset library for the current DF folder."""
+    global _library #pylint: disable=global-statement
+    if _library is None or _library.art != paths.get('data', 'art'):
+        _library = TilesetLibrary(paths.get('data', 'art'),
+                                  paths.get('tilesets'))
+    return _library
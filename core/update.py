@@ -95,7 +95,13 @@ def download_df_baseline(immediate=False):
     url = 'http://www.bay12games.com/dwarves/' + filename
     target = os.path.join(paths.get('baselines'), filename)
     queue_name = 'immediate' if immediate else 'baselines'
-    download.download(queue_name, url, target)
+    download.download(queue_name, url, target,
+                      end_callback=_baseline_downloaded)
+
+def _baseline_downloaded(*_):
+    """Makes the next baseline lookup prepare the downloaded release."""
+    from . import baselines
+    baselines.registry.invalidate()
 
 def direct_download_pack():
     """Directly download a new version of the pack to the current BASEDIR"""
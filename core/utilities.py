@@ -30,11 +30,13 @@ from __future__ import print_function, unicode_literals, absolute_import
 
 import os
 import re
-from fnmatch import fnmatch
+import collections
+from fnmatch import translate
+from threading import Lock, Thread
 # pylint:disable=redefined-builtin
 from io import open
 
-from . import log, manifest, paths
+from . import helpers, log, manifest, paths, statcache
 from .launcher import open_file
 from .lnp import lnp
 
@@ -65,15 +67,11 @@ def get_title(path):
     Returns a title for the given utility. If an non-blank override exists, it
     will be used; otherwise, the filename will be manipulated according to
     PyLNP.json settings."""
-    config = manifest_for(path)
-    if config is not None:
-        if config.get_string('title'):
-            return config.get_string('title')
-    else:
-        metadata = read_metadata()
-        if os.path.basename(path) in metadata:
-            if metadata[os.path.basename(path)]['title']:
-                return metadata[os.path.basename(path)]['title']
+    entry = catalog().get(path)
+    if entry is None:
+        entry = _describe(path, read_metadata())
+    if entry['title']:
+        return entry['title']
     head, result = os.path.split(path)
     if not lnp.config.get_bool('hideUtilityPath'):
         result = os.path.join(os.path.basename(head), result)
@@ -83,10 +81,22 @@ def get_title(path):
 
 def get_tooltip(path):
     """Returns the tooltip for the given utility, or an empty string."""
+    entry = catalog().get(path)
+    if entry is None:
+        entry = _describe(path, read_metadata())
+    return entry['tooltip']
+
+def _describe(path, metadata):
+    """Returns a dict with the title override (possibly blank) and tooltip
+    for the utility <path>, from its manifest or from <metadata>."""
     config = manifest_for(path)
     if config is not None:
-        return config.get_string('tooltip')
-    return read_metadata().get(os.path.basename(path), {}).get('tooltip', '')
+        return {'title': config.get_string('title'),
+                'tooltip': config.get_string('tooltip')}
+    meta = metadata.get(os.path.basename(path), {})
+    title = meta.get('title', '')
+    return {'title': title if title != 'EXCLUDE' else '',
+            'tooltip': meta.get('tooltip', '')}
 
 def read_utility_lists(path):
     """
@@ -114,49 +124,262 @@ def scan_manifest_dir(root):
             return os.path.join(m_path, util)
         log.w('Utility not found:  {}'.format(os.path.join(m_path, util)))
 
-def any_match(filename, include, exclude):
-    """Return True if at least one pattern matches the filename, or False."""
-    return any(fnmatch(filename, p) for p in include) and \
-        not any(fnmatch(filename, p) for p in exclude)
+def compile_patterns(patterns):
+    """Returns a compiled regex matching filenames that match any of the
+    glob <patterns> (as for fnmatch), or None if there are no patterns."""
+    if not patterns:
+        return None
+    flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+    return re.compile('|'.join(
+        '(?:{})'.format(translate(p)) for p in patterns), flags)
 
-def scan_normal_dir(root, dirnames, filenames):
+class UtilityPatterns(object):
+    """The patterns used to identify utilities outside manifest folders,
+    read once from the utility lists and compiled into one regex each."""
+    def __init__(self):
+        self.metadata = read_metadata()
+        patterns = ['*.jar', '*.sh']
+        if lnp.os == 'win':
+            patterns = ['*.jar', '*.exe', '*.bat']
+        exclude = read_utility_lists(paths.get('utilities', 'exclude.txt'))
+        exclude += [u for u in self.metadata
+                    if self.metadata[u]['title'] == 'EXCLUDE']
+        include = read_utility_lists(paths.get('utilities', 'include.txt'))
+        include += [u for u in self.metadata
+                    if self.metadata[u]['title'] != 'EXCLUDE']
+        self.include = compile_patterns(patterns + include)
+        self.exclude = compile_patterns(exclude)
+        self.bundle = compile_patterns(['*.app'])
+
+    def matches(self, filename, bundle=False):
+        """Returns True if <filename> is included and not excluded. If
+        <bundle> is True, matches OS X application bundles instead."""
+        include = self.bundle if bundle else self.include
+        return bool(include.match(filename)) and not (
+            self.exclude and self.exclude.match(filename))
+
+def scan_normal_dir(root, dirnames, filenames, patterns=None):
     """Yields candidate utilities in the given root directory.
 
     Allow for an include list of filenames that will be treated as valid
     utilities. Useful for e.g. Linux, where executables rarely have
     extensions.  Also accepts glob patterns for filename (not path).
+    Pass a UtilityPatterns object as <patterns> to avoid reading the lists
+    again for each directory.
     """
-    metadata = read_metadata()
-    patterns = ['*.jar', '*.sh']
-    if lnp.os == 'win':
-        patterns = ['*.jar', '*.exe', '*.bat']
-    exclude = read_utility_lists(paths.get('utilities', 'exclude.txt'))
-    exclude += [u for u in metadata if metadata[u]['title'] == 'EXCLUDE']
-    include = read_utility_lists(paths.get('utilities', 'include.txt'))
-    include += [u for u in metadata if metadata[u]['title'] != 'EXCLUDE']
+    if patterns is None:
+        patterns = UtilityPatterns()
     if lnp.os == 'osx':
         # OS X application bundles are really directories, and always end .app
         for dirname in dirnames:
-            if any_match(dirname, ['*.app'], exclude):
+            if patterns.matches(dirname, bundle=True):
                 yield os.path.relpath(os.path.join(root, dirname),
                                       paths.get('utilities'))
     for filename in filenames:
-        if any_match(filename, patterns + include, exclude):
+        if patterns.matches(filename):
             yield os.path.relpath(os.path.join(root, filename),
                                   paths.get('utilities'))
 
-def read_utilities():
-    """Returns a sorted list of utility programs."""
-    utilities = []
-    for root, dirs, files in os.walk(paths.get('utilities')):
+# Version of .catalog.json, changed along with the contents of its entries
+CATALOG_VERSION = 1
+# Files in LNP/Utilities that change which utilities are found
+_LIST_FILES = ('utilities.txt', 'include.txt', 'exclude.txt')
+
+class UtilityCatalog(object):
+    """Cached results of scanning LNP/Utilities.
+
+    For each folder, the catalog holds the utilities found directly in it
+    and its subfolders, keyed by the signature of the folder and its
+    manifest, so that only folders whose contents changed are listed again.
+    Titles and tooltips are stored with the utilities.  The catalog is saved
+    in ``LNP/Utilities/.catalog.json``, and rebuilt entirely if the utility
+    lists, the OS or the DF version change."""
+    def __init__(self, folder):
+        """Constructor for UtilityCatalog.
+
+        Params:
+            folder
+                the utilities folder
+        """
+        self.folder = folder
+        self.filename = os.path.join(folder, '.catalog.json')
+        self.lock = Lock()
+        self.scan_lock = Lock()
+        data = statcache.load(self.filename, CATALOG_VERSION) or {}
+        self.context = data.get('context')
+        self.dirs = data.get('dirs', {})
+        self.utils = data.get('utils', {})
+
+    def _context(self):
+        """Returns the settings and files that the scan results depend on."""
+        return [lnp.os, str(lnp.df_info.version),
+                'dfhack' in lnp.df_info.variations] + [
+                    statcache.signature(os.path.join(self.folder, f))
+                    for f in _LIST_FILES]
+
+    def _signature(self, rel):
+        """Returns the signature of the folder <rel>."""
+        folder = os.path.join(self.folder, rel)
+        return [statcache.signature(folder),
+                statcache.signature(os.path.join(folder, 'manifest.json'))]
+
+    def _scan_dir(self, rel, patterns):
+        """Returns a new catalog entry for the folder <rel>."""
+        root = os.path.join(self.folder, rel)
+        dirs, files = helpers.list_dir(root)
+        if not rel:
+            files = [f for f in files if f != os.path.basename(self.filename)]
         if 'manifest.json' in files:
             util = scan_manifest_dir(root)
-            if util is not None:
-                utilities.append(util)
-            dirs[:] = []  # Don't run normal scan in subdirs
-        else:
-            utilities.extend(scan_normal_dir(root, dirs, files))
-    return sorted(utilities, key=get_title)
+            return {'utils': [util] if util is not None else [],
+                    'subdirs': []}
+        return {'utils': list(scan_normal_dir(root, dirs, files, patterns)),
+                'subdirs': dirs}
+
+    def scan(self):
+        """Brings the catalog up to date with the utilities folder, yielding
+        each utility as it is found. The catalog is saved once the scan is
+        complete; stopping early leaves the saved catalog unchanged.
+        Callers must hold scan_lock.
+
+        Yields:
+            paths of utilities, relative to the utilities folder
+        """
+        context = self._context()
+        with self.lock:
+            if context != self.context:
+                self.dirs, self.utils = {}, {}
+                self.context = context
+        patterns = None
+        seen_dirs, seen_utils, changed = set(), set(), False
+        pending = ['']
+        while pending:
+            rel = pending.pop(0)
+            sig = self._signature(rel)
+            entry = self.dirs.get(rel)
+            if entry is None or entry['sig'] != sig:
+                if sig[0] is None:
+                    continue
+                if patterns is None:
+                    patterns = UtilityPatterns()
+                entry = self._scan_dir(rel, patterns)
+                entry['sig'] = sig
+                with self.lock:
+                    self.dirs[rel] = entry
+                    for util in entry['utils']:
+                        self.utils[util] = _describe(util, patterns.metadata)
+                changed = True
+            seen_dirs.add(rel)
+            pending = [os.path.join(rel, d) for d in entry['subdirs']] + \
+                pending
+            for util in entry['utils']:
+                seen_utils.add(util)
+                yield util
+        with self.lock:
+            for rel in set(self.dirs) - seen_dirs:
+                del self.dirs[rel]
+                changed = True
+            for util in set(self.utils) - seen_utils:
+                del self.utils[util]
+                changed = True
+        if changed:
+            self.save()
+
+    def refresh(self):
+        """Brings the catalog up to date, and returns a list of utilities."""
+        with self.scan_lock:
+            return list(self.scan())
+
+    def save(self):
+        """Saves the catalog."""
+        with self.lock:
+            statcache.save(self.filename, CATALOG_VERSION, {
+                'context': self.context, 'dirs': self.dirs,
+                'utils': self.utils})
+
+    def get(self, util):
+        """Returns the title and tooltip of <util> as a dict, or None if it
+        was not found by the last scan."""
+        with self.lock:
+            return self.utils.get(util)
+
+_catalog = None
+
+def catalog():
+    """Returns the catalog for the current utilities folder."""
+    global _catalog #pylint: disable=global-statement
+    if _catalog is None or _catalog.folder != paths.get('utilities'):
+        _catalog = UtilityCatalog(paths.get('utilities'))
+    return _catalog
+
+def read_utilities():
+    """Returns a sorted list of utility programs."""
+    return sorted(catalog().refresh(), key=get_title)
+
+class UtilityScan(object):
+    """Scans the utilities folder on a worker thread, collecting the
+    utilities found in batches that can be collected with poll().
+
+    Only one scan of the catalog runs at a time; a new scan waits for a
+    cancelled one to stop before it starts."""
+    def __init__(self, batch_size=25):
+        """Constructor for UtilityScan; starts the scan.
+
+        Params:
+            batch_size
+                the number of utilities to find before making them
+                available to poll()
+        """
+        self.batch_size = batch_size
+        self.batches = collections.deque()
+        self.cancelled = False
+        self.done = False
+        self.thread = Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        """Runs the scan on the worker thread."""
+        # pylint:disable=bare-except
+        utilities = catalog()
+        with utilities.scan_lock:
+            try:
+                if self.cancelled:
+                    return
+                batch = []
+                scan = utilities.scan()
+                for util in scan:
+                    if self.cancelled:
+                        scan.close()
+                        return
+                    batch.append(util)
+                    if len(batch) >= self.batch_size:
+                        self.batches.append(batch)
+                        batch = []
+                if batch:
+                    self.batches.append(batch)
+            except:
+                log.e('Error while scanning utilities', stack=True)
+            finally:
+                self.done = True
+
+    def cancel(self):
+        """Stops the scan at the next utility found. Results that were not
+        collected yet are discarded."""
+        self.cancelled = True
+        self.batches.clear()
+
+    def poll(self):
+        """Returns a list of the utilities found since the last call."""
+        result = []
+        while self.batches:
+            result.extend(self.batches.popleft())
+        return result
+
+    def finished(self):
+        """Returns True if the scan has ended and all results were
+        collected."""
+        return self.done and not self.batches
 
 def toggle_autorun(item):
     """
@@ -0,0 +1 @@
+"""Tests for PyLNP core functionality."""
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for writing to raws installed as link farms."""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os, shutil, tempfile, unittest
+# pylint:disable=redefined-builtin
+from io import open
+
+from core import linkfarm
+from core.dfraw import DFRaw
+
+STONE_LAYER = ('inorganic_stone_layer\n\n[OBJECT:INORGANIC]\n\n'
+               '[INORGANIC:SANDSTONE]\n\t[AQUIFER]\n\t[SEDIMENTARY]\n')
+
+class InstalledRawsTest(unittest.TestCase):
+    """Changing installed raws must not change the files they link to."""
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.baseline = os.path.join(self.root, 'baseline', 'raw')
+        self.installed = os.path.join(self.root, 'df', 'raw')
+        os.makedirs(os.path.join(self.baseline, 'objects'))
+        os.makedirs(os.path.dirname(self.installed))
+        self.baseline_file = os.path.join(
+            self.baseline, 'objects', 'inorganic_stone_layer.txt')
+        with open(self.baseline_file, 'w') as f:
+            f.write(STONE_LAYER)
+        linkfarm.install_tree(self.baseline, self.installed)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_aquifer_toggle_keeps_baseline(self):
+        """Disabling aquifers, as settings.update_file does, only changes the
+        installed file."""
+        installed_file = os.path.join(
+            self.installed, 'objects', 'inorganic_stone_layer.txt')
+        with DFRaw(installed_file) as raw:
+            raw.set_all('AQUIFER', False)
+        self.assertNotIn('[AQUIFER]', DFRaw.read(installed_file))
+        self.assertEqual(DFRaw.read(self.baseline_file), STONE_LAYER)
+        self.assertFalse(linkfarm.is_shared(self.baseline_file))
+
+if __name__ == '__main__':
+    unittest.main()
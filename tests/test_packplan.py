@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for planning pack simplification."""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import ntpath, os, unittest
+
+from core import baselines, packplan
+
+class KeepTrieTest(unittest.TestCase):
+    """Paths with several parts are kept on all platforms."""
+    def kept(self, trie, path):
+        """Returns True if the file at the '/'-separated <path> is kept."""
+        node = trie.root
+        parts = path.split('/')
+        for part in parts[:-1]:
+            node = trie.child(node, part)
+            if node is None:
+                return False
+        return trie.keeps(node, parts[-1])
+
+    def check_graphics(self):
+        """Checks the patterns for graphics packs."""
+        trie = packplan.KeepTrie(baselines.keep_patterns('graphics'))
+        for path in ('raw/objects/creature_standard.txt',
+                     'raw/graphics/graphics_example.txt',
+                     'data/art/curses_640x300.png', 'data/init/init.txt',
+                     'data/init/colors.txt', 'manifest.json'):
+            self.assertTrue(self.kept(trie, path), path)
+        for path in ('raw/other.txt', 'data/init/interface.txt',
+                     'data/speech/greet.txt', 'notes.txt'):
+            self.assertFalse(self.kept(trie, path), path)
+
+    def check_mods(self):
+        """Checks the patterns for mods."""
+        trie = packplan.KeepTrie(baselines.keep_patterns('mods'))
+        for path in ('raw/objects/plant.txt', 'data/speech/greet.txt'):
+            self.assertTrue(self.kept(trie, path), path)
+        self.assertFalse(self.kept(trie, 'data/art/x.png'))
+
+    def test_posix(self):
+        """Patterns are split on '/' with POSIX path rules."""
+        self.check_graphics()
+        self.check_mods()
+
+    def test_windows(self):
+        """Patterns are split on '/' before normcase turns it into '\\'."""
+        original = os.path.normcase
+        os.path.normcase = ntpath.normcase
+        try:
+            self.check_graphics()
+            self.check_mods()
+            trie = packplan.KeepTrie(['Data/Art'])
+            self.assertTrue(self.kept(trie, 'data/ART/x.png'))
+        finally:
+            os.path.normcase = original
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for the object-aware raw merge engine."""
+from __future__ import print_function, unicode_literals, absolute_import
+
+import unittest
+
+from core import rawmerge
+
+HEADER = 'creature_test\n\n[OBJECT:CREATURE]\n\n'
+
+def creatures(*bodies):
+    """Returns the lines of a creature file with one creature per body."""
+    text = HEADER + ''.join(
+        '[CREATURE:C{}]\n{}'.format(i, body) for i, body in enumerate(bodies))
+    return text.splitlines(True)
+
+def no_line_merge(mod, van, gen):
+    """Stands in for mods.merge_line_list where headers are unchanged."""
+    raise AssertionError('line merge used for {!r}'.format((mod, van, gen)))
+
+class MergeTokensTest(unittest.TestCase):
+    """Three-way merges of token sequences."""
+    def test_separate_changes(self):
+        """Changes to different tokens are all kept."""
+        self.assertEqual(
+            rawmerge.merge_tokens('aXcd', 'abcd', 'abcY'),
+            (0, list('aXcY')))
+
+    def test_same_insertion_point(self):
+        """Insertions at the same place by both sides are both kept."""
+        self.assertEqual(
+            rawmerge.merge_tokens('xWy', 'xy', 'xZy'), (1, list('xZWy')))
+
+    def test_identical_changes(self):
+        """The same change made by both sides is applied once."""
+        self.assertEqual(
+            rawmerge.merge_tokens('aXc', 'abc', 'aXc'), (0, list('aXc')))
+
+    def test_overlapping_changes(self):
+        """Overlapping changes are reported, and the mod's version wins."""
+        self.assertEqual(
+            rawmerge.merge_tokens('aMc', 'abc', 'aGc'), (2, list('aMc')))
+
+class MergeObjectListsTest(unittest.TestCase):
+    """Merges of raw files object by object."""
+    def merge(self, mod, van, gen):
+        """Merges lists of creature bodies."""
+        return rawmerge.merge_object_lists(
+            creatures(*mod), creatures(*van), creatures(*gen), no_line_merge)
+
+    def test_different_objects(self):
+        """Mods changing different objects don't conflict."""
+        status, lines = self.merge(
+            ['\t[A]\n', '\t[B:2]\n'], ['\t[A]\n', '\t[B]\n'],
+            ['\t[A:1]\n', '\t[B]\n'])
+        self.assertEqual(status, 0)
+        self.assertEqual(lines, creatures('\t[A:1]\n', '\t[B:2]\n'))
+
+    def test_tags_added_after_same_tag(self):
+        """Tags added after the same tag by both sides are all kept."""
+        status, lines = self.merge(
+            ['\t[X]\n\t[W]\n'], ['\t[X]\n'], ['\t[X]\n\t[Z]\n'])
+        self.assertEqual(status, 1)
+        self.assertEqual(lines, creatures('\t[X]\n\t[Z]\n\t[W]\n'))
+
+    def test_same_tag_changed(self):
+        """A tag changed by both sides is reported as overwritten."""
+        status, lines = self.merge(
+            ['\t[X:2]\n\t[Y]\n'], ['\t[X]\n\t[Y]\n'], ['\t[X:1]\n\t[Y]\n'])
+        self.assertEqual(status, 2)
+        self.assertEqual(lines, creatures('\t[X:2]\n\t[Y]\n'))
+
+    def test_new_objects_placed_after_predecessor(self):
+        """New objects follow their predecessor in the mod, or come first."""
+        mod = creatures('\t[A]\n') + ['[CREATURE:NEW]\n', '\t[N]\n']
+        mod = HEADER.splitlines(True) + ['[CREATURE:FIRST]\n'] + mod[4:]
+        status, lines = rawmerge.merge_object_lists(
+            mod, creatures('\t[A]\n'), creatures('\t[A]\n'), no_line_merge)
+        self.assertEqual(status, 0)
+        self.assertEqual(
+            [l for l in lines if l.startswith('[CREATURE')],
+            ['[CREATURE:FIRST]\n', '[CREATURE:C0]\n', '[CREATURE:NEW]\n'])
+
+    def test_duplicate_ids(self):
+        """Files with an object id twice are left to the line merge."""
+        van = creatures('\t[A]\n')
+        self.assertIsNone(rawmerge.merge_object_lists(
+            van + van[4:], van, van, no_line_merge))
+
+if __name__ == '__main__':
+    unittest.main()
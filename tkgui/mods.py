@@ -6,7 +6,7 @@ from __future__ import print_function, unicode_literals, absolute_import
 
 import sys
 
-from core import mods
+from core import inventory, mods
 
 from . import controls, tkhelpers
 from .layout import GridLayouter
@@ -37,8 +37,9 @@ class ModsTab(Tab):
 
     def read_data(self):
         mods.clear_temp()
-        self.available = mods.read_mods()
-        self.installed = mods.get_installed_mods_from_log()
+        snapshot = inventory.Inventory()
+        self.available = list(snapshot.mods)
+        self.installed = mods.get_installed_mods_from_log(snapshot)
         self.available = [m for m in self.available if m not in self.installed]
         self.update_lists()
 
@@ -87,6 +88,12 @@ class ModsTab(Tab):
             'Whether to start with the current graphics pack, or '
             'vanilla (ASCII) raws', self.toggle_preload, 'premerge_graphics',
             lambda v: ('NO', 'YES')[mods.will_premerge_gfx()]))
+        main_grid.add(controls.create_trigger_option_button(
+            self, 'Merge By Object',
+            'Whether to merge raw files creature by creature (object by '
+            'object), or line by line', self.toggle_object_merge,
+            'merge_objects',
+            lambda v: ('NO', 'YES')[mods.will_merge_objects()]))
         main_grid.add(controls.create_trigger_button(
             self, 'Simplify Mods', 'Removes unnecessary files.',
             self.simplify_mods))
@@ -108,6 +115,11 @@ class ModsTab(Tab):
         """Toggles whether to preload graphics before merging mods."""
         mods.toggle_premerge_gfx()
 
+    def toggle_object_merge(self):
+        """Toggles whether to merge raws by object, and re-merges."""
+        mods.toggle_object_merge()
+        self.perform_merge()
+
     def move_up(self):
         """Moves the selected item/s up in the merge order and re-merges."""
         if len(self.installed_list.curselection()) == 0:
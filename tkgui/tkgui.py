@@ -11,7 +11,7 @@ from threading import Semaphore
 from core.helpers import get_resource
 from core.lnp import lnp, VERSION
 from core import df, launcher, log, paths, update, mods, download, baselines
-from core import terminal, importer
+from core import terminal, importer, dedup
 
 from . import controls, binding
 from .child_windows import LogWindow, InitEditor, SelectDF, UpdateWindow
@@ -389,6 +389,8 @@ class TkGui(object):
         menu_file.add_command(
             label='Import from previous install...',
             command=self.migrate_settings)
+        menu_file.add_command(
+            label='Deduplicate raw files', command=self.dedup_raws)
 
         if sys.platform != 'darwin':
             menu_file.add_command(
@@ -451,6 +453,14 @@ class TkGui(object):
         root.createcommand('tkAboutDialog', self.show_about)
         return menubar
 
+    def dedup_raws(self):
+        """Shares identical raw files between savegames and baselines."""
+        files, size = dedup.dedup_raws()
+        messagebox.showinfo(
+            self.root.title(),
+            'Linked {} identical raw files, freeing {:.1f} MB.'.format(
+                files, size / 1048576.0))
+
     def reload_program(self):
         """Reloads the program to allow the user to change DF folders."""
         self.do_reload = True
@@ -21,6 +21,8 @@ def check_vanilla_raws():
     """Validates status of vanilla raws are ready."""
     if not download.get_queue('baselines').empty():
         return False
+    if baselines.vanilla_ready():
+        return True
     raw_status = baselines.find_vanilla_raws()
     if raw_status is None:
         messagebox.showerror(
@@ -5,6 +5,7 @@
 from __future__ import print_function, unicode_literals, absolute_import
 
 import sys
+from bisect import bisect_right
 
 from core import launcher, paths, utilities
 from core.lnp import lnp
@@ -26,13 +27,17 @@ else:
 #pylint: disable=too-many-public-methods
 class UtilitiesTab(Tab):
     """Utilities tab for the TKinter GUI."""
+    # Milliseconds between checks for newly found utilities
+    POLL_DELAY = 100
+
+    def create_variables(self):
+        self.scan = None
+        self.scan_event = None
+        self.titles = []
+
     def read_data(self):
         self.read_utilities()
 
-        # Fix focus bug
-        if self.proglist.get_children():
-            self.proglist.focus(self.proglist.get_children()[0])
-
     def create_controls(self):
         progs = controls.create_control_group(
             self, 'Programs/Utilities', True)
@@ -119,15 +124,38 @@ class UtilitiesTab(Tab):
             tooltip.event = proglist.after(controls._TOOLTIP_DELAY, show)
 
     def read_utilities(self):
-        """Reads list of utilities."""
+        """Reads list of utilities. The folder is scanned in the background,
+        and utilities are added to the list as they are found; a scan that
+        is still running is cancelled."""
+        if self.scan is not None:
+            self.scan.cancel()
+        if self.scan_event is not None:
+            self.after_cancel(self.scan_event)
+            self.scan_event = None
         for prog in self.proglist.get_children():
             self.proglist.delete(prog)
-
-        for prog in utilities.read_utilities():
-            self.proglist.insert('', 'end', prog,
-                                 text=utilities.get_title(prog),
+        self.titles = []
+        self.scan = utilities.UtilityScan()
+        self.poll_utilities()
+
+    def poll_utilities(self):
+        """Adds utilities found by the current scan to the list, in title
+        order, and checks again later until the scan is finished."""
+        self.scan_event = None
+        for prog in self.scan.poll():
+            if self.proglist.exists(prog):
+                continue
+            title = utilities.get_title(prog)
+            index = bisect_right(self.titles, title)
+            self.titles.insert(index, title)
+            self.proglist.insert('', index, prog, text=title,
                                  values=(prog, utilities.get_tooltip(prog)))
-        self.update_autorun_list()
+            self.proglist.tag_set('autorun', prog, prog in lnp.autorun)
+            # Fix focus bug
+            if not self.proglist.focus():
+                self.proglist.focus(prog)
+        if not self.scan.finished():
+            self.scan_event = self.after(self.POLL_DELAY, self.poll_utilities)
 
     def toggle_autorun(self, event):
         """